@@ -0,0 +1,130 @@
+import os
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, List
+
+import orjson
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+CASSETTE_MODES = ("record", "replay")
+
+# 不影响模型输出、不参与请求哈希的参数
+_IGNORED_REQUEST_KEYS = {"timeout"}
+
+
+class CassetteMissError(LookupError):
+    """回放模式下找不到与请求对应的 cassette"""
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """对请求参数做规范化序列化后取 sha256，作为 cassette 文件名"""
+    payload = {
+        k: v
+        for k, v in request.items() if k not in _IGNORED_REQUEST_KEYS
+    }
+    return hashlib.sha256(
+        orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class Cassette:
+    """
+    LLM 调用的录制/回放层。
+
+    record 模式下真实调用模型，并把 请求哈希 -> 响应 写入 cassette_dir，
+    流式响应会同时记录每个 chunk 相对请求开始的时间；
+    replay 模式下不访问网络，直接从 cassette 返回响应，
+    按 speed 倍速重放录制时的耗时（speed <= 0 表示不等待）。
+    """
+
+    def __init__(self, mode: str, cassette_dir: str, speed: float = 1.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        self.mode = mode
+        self.cassette_dir = cassette_dir
+        self.speed = speed
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cassette_dir, f"{key}.json")
+
+    def _save(self, key: str, cassette: Dict[str, Any]) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(cassette, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_path, path)
+
+    def _load(self, key: str) -> Dict[str, Any]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            raise CassetteMissError(f"No cassette for request {key}")
+
+    async def _sleep_until(self, start_time: float, offset: float) -> None:
+        if self.speed <= 0:
+            return
+        delay = start_time + offset / self.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def create(self, client: Any, **request: Any) -> Any:
+        """代替 client.chat.completions.create，按模式录制或回放"""
+        key = request_key(request)
+        if self.mode == "replay":
+            return await self._replay(key)
+        return await self._record(key, client, request)
+
+    async def _record(self, key: str, client: Any,
+                      request: Dict[str, Any]) -> Any:
+        start_time = time.perf_counter()
+        response = await client.chat.completions.create(**request)
+        latency = time.perf_counter() - start_time
+        recorded_request = {
+            k: v
+            for k, v in request.items() if k not in _IGNORED_REQUEST_KEYS
+        }
+        if not request.get("stream"):
+            self._save(
+                key, {
+                    "request": recorded_request,
+                    "stream": False,
+                    "latency": latency,
+                    "response": response.model_dump(mode="json"),
+                })
+            return response
+        return self._record_stream(key, recorded_request, response,
+                                   start_time, latency)
+
+    async def _record_stream(self, key: str, request: Dict[str, Any],
+                             response: AsyncIterator[Any], start_time: float,
+                             latency: float) -> AsyncIterator[Any]:
+        chunks: List[Dict[str, Any]] = []
+        async for chunk in response:
+            chunks.append({
+                "offset": time.perf_counter() - start_time,
+                "chunk": chunk.model_dump(mode="json"),
+            })
+            yield chunk
+        self._save(
+            key, {
+                "request": request,
+                "stream": True,
+                "latency": latency,
+                "chunks": chunks,
+            })
+
+    async def _replay(self, key: str) -> Any:
+        cassette = self._load(key)
+        start_time = time.perf_counter()
+        await self._sleep_until(start_time, cassette["latency"])
+        if not cassette["stream"]:
+            return ChatCompletion.model_validate(cassette["response"])
+        return self._replay_stream(cassette["chunks"], start_time)
+
+    async def _replay_stream(self, chunks: List[Dict[str, Any]],
+                             start_time: float) -> AsyncIterator[Any]:
+        for chunk in chunks:
+            await self._sleep_until(start_time, chunk["offset"])
+            yield ChatCompletionChunk.model_validate(chunk["chunk"])
@@ -0,0 +1,70 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """请求的时间预算已用完"""
+
+
+class Deadline:
+    """基于单调时钟的截止时间"""
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    "current_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(timeout: Optional[float]) -> Iterator[Optional[Deadline]]:
+    """
+    在当前上下文中设置截止时间，已有更早的截止时间时沿用更早的那个。
+
+    :param timeout: 剩余时间预算（秒），None 表示不额外限制
+    """
+    outer = current_deadline.get()
+    if timeout is None:
+        yield outer
+        return
+    deadline = Deadline(timeout)
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """
+    当前上下文剩余的时间预算。
+
+    :return: 剩余秒数，未设置截止时间时返回 None
+    :raises DeadlineExceeded: 已超过截止时间
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return remaining
+
+
+def stop_before_deadline(retry_state) -> bool:
+    """tenacity stop 条件：下一次等待会超过截止时间时不再重试"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return False
+    return deadline.remaining() <= (retry_state.upcoming_sleep or 0)
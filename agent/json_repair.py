@@ -0,0 +1,88 @@
+import json
+from typing import Any, List, Tuple
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def strip_code_fence(text: str) -> str:
+    """去掉模型输出中可能包裹的 ```json ... ``` 代码块标记"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    return text.strip()
+
+
+def _find_cut_points(text: str) -> List[Tuple[int, str]]:
+    """
+    扫描 JSON 文本，记录所有可以安全截断的位置。
+
+    可截断的位置包括：容器刚打开之后、逗号之前、容器闭合之后。
+    每个位置同时记录补全所需的闭合符号。
+
+    :param text: 以 { 或 [ 开头的 JSON 文本
+    :return: [(截断位置, 闭合后缀), ...]，按位置升序
+    """
+    cut_points = []
+    stack = []
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+            cut_points.append((i + 1, "".join(reversed(stack))))
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            cut_points.append((i + 1, "".join(reversed(stack))))
+            if not stack:
+                break
+        elif ch == "," and stack:
+            cut_points.append((i, "".join(reversed(stack))))
+    return cut_points
+
+
+def repair_partial_json(text: str, max_attempts: int = 64) -> Any:
+    """
+    容错解析被截断或末尾残缺的 JSON。
+
+    先尝试直接解析；失败时从最后一个可截断位置开始向前回退，
+    丢弃末尾不完整的值并补全闭合符号，直到能成功解析为止。
+    已经完整输出的元素和字段都会被保留，末尾未写完的对象可能只含部分字段，
+    需要调用方自行校验。
+
+    :param text: 模型返回的原始文本
+    :param max_attempts: 最多尝试的截断位置数
+    :return: 解析后的 JSON 对象
+    :raises json.JSONDecodeError: 无法修复时抛出
+    """
+    text = strip_code_fence(text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as je:
+        error = je
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise error
+    text = text[min(starts):]
+
+    cut_points = _find_cut_points(text)
+    for cut, suffix in reversed(cut_points[-max_attempts:]):
+        try:
+            return json.loads(text[:cut] + suffix)
+        except json.JSONDecodeError:
+            continue
+    raise error
@@ -1,11 +1,17 @@
 import json
 from loguru import logger
-from typing import Dict, List, Literal, Optional, Union
-from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal, Optional, Union
+from pydantic import BaseModel, Field, ValidationError
 
-from openai import (APIError, AsyncOpenAI, AuthenticationError, OpenAIError,
-                    RateLimitError, AsyncAzureOpenAI)
-from tenacity import retry, stop_after_attempt, wait_random_exponential
+from openai import (APIError, APITimeoutError, AsyncOpenAI,
+                    AuthenticationError, OpenAIError, RateLimitError,
+                    AsyncAzureOpenAI)
+from tenacity import (retry, retry_if_exception_type,
+                      retry_if_not_exception_type, stop_after_attempt,
+                      wait_random_exponential)
+from agent.cassette import Cassette, CassetteMissError
+from agent.deadline import (DeadlineExceeded, current_deadline, remaining_time,
+                            stop_before_deadline)
 from agent.data_format import Message
 
 class LLMSettings(BaseModel):
@@ -18,13 +24,40 @@ class LLMSettings(BaseModel):
     api_type: str = Field(..., description="AzureOpenai or Openai")
     api_version: str = Field(...,
                              description="Azure Openai version if AzureOpenai")
+    cassette_mode: str = Field(
+        "", description="Record/replay LLM calls: '', 'record' or 'replay'")
+    cassette_dir: str = Field("cassettes",
+                              description="Directory of recorded cassettes")
+    cassette_speed: float = Field(
+        1.0,
+        description="Replay speed multiplier, <= 0 replays without waiting")
+
+class StructuredOutputError(ValueError):
+    """模型返回的内容无法解析为指定的结构化输出或被截断，保留原始文本以便上层做修复"""
+
+    def __init__(self,
+                 message: str,
+                 raw_response: str,
+                 finish_reason: Optional[str] = None):
+        super().__init__(message)
+        self.raw_response = raw_response
+        self.finish_reason = finish_reason
+
 
 class LLM:
 
     def __init__(self,
-                 llm_config: LLMSettings):
+                 llm_config: LLMSettings,
+                 rate_limiter: Optional[Any] = None):
+        """
+        Args:
+            llm_config: LLM settings
+            rate_limiter: Optional limiter with an async ``acquire()`` awaited
+                before every API request, e.g. agent.shared_state.SharedRateLimiter
+        """
         if not hasattr(self,
                        "client"):  # Only initialize if not already initialized
+            self.rate_limiter = rate_limiter
             self.model = llm_config.model
             self.max_tokens = llm_config.max_tokens
             self.temperature = llm_config.temperature
@@ -39,6 +72,31 @@ class LLM:
             else:
                 self.client = AsyncOpenAI(api_key=self.api_key,
                                           base_url=self.base_url)
+            self.cassette = Cassette(
+                llm_config.cassette_mode, llm_config.cassette_dir,
+                llm_config.cassette_speed) if llm_config.cassette_mode else None
+
+    async def create_completion(self, **kwargs):
+        """
+        Call chat.completions.create, or go through the record/replay cassette
+        when one is configured. The remaining request deadline (see
+        agent.deadline) is passed down as the per-request timeout.
+
+        Raises:
+            DeadlineExceeded: If the deadline has passed before or during the call
+        """
+        timeout = remaining_time()
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        try:
+            if self.cassette is not None:
+                return await self.cassette.create(self.client, **kwargs)
+            return await self.client.chat.completions.create(**kwargs)
+        except APITimeoutError as te:
+            deadline = current_deadline.get()
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded("Request deadline exceeded") from te
+            raise
 
     @staticmethod
     def format_messages(messages: List[Union[dict, Message]]) -> List[dict]:
@@ -88,7 +146,10 @@ class LLM:
 
     @retry(
         wait=wait_random_exponential(min=1, max=60),
-        stop=stop_after_attempt(6),
+        stop=stop_after_attempt(6) | stop_before_deadline,
+        # Only retry Exception so asyncio.CancelledError is never swallowed
+        retry=retry_if_exception_type(Exception) & retry_if_not_exception_type(
+            (CassetteMissError, DeadlineExceeded)),
     )
     async def ask(
         self,
@@ -121,9 +182,11 @@ class LLM:
                 messages = system_msgs + self.format_messages(messages)
             else:
                 messages = self.format_messages(messages)
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
             if not stream:
                 # Non-streaming request
-                response = await self.client.chat.completions.create(
+                response = await self.create_completion(
                     model=self.model,
                     messages=messages,
                     max_tokens=self.max_tokens,
@@ -135,7 +198,7 @@ class LLM:
                     raise ValueError("Empty or invalid response from LLM")
                 return response.choices[0].message.content
             # Streaming request
-            response = await self.client.chat.completions.create(
+            response = await self.create_completion(
                 model=self.model,
                 messages=messages,
                 max_tokens=self.max_tokens,
@@ -173,6 +236,7 @@ class LLM:
         temperature: Optional[float] = None,
         stream: bool = False,
         enable_thinking: bool = False,
+        max_tokens: Optional[int] = None,
     ) -> BaseModel:
         """
         Send a prompt to the LLM  and parse the response into the specified structured output.
@@ -183,11 +247,15 @@ class LLM:
             system_msgs: Optional system messages to prepend
             stream (bool): Whether to stream the response
             temperature (float): Sampling temperature for the response
+            max_tokens (int): Optional override of the per-request token limit
 
         Returns:
             BaseModel: pydantic basemodel class
 
         Raises:
+            StructuredOutputError: If the response is not valid JSON, does not
+                match response_format or was cut off by max_tokens
+                (finish_reason == "length"); carries the raw response text
             ValueError: If messages are invalid or response is empty
             OpenAIError: If API call fails after retries
             Exception: For unexpected errors
@@ -202,26 +270,35 @@ class LLM:
                                   self.format_messages(messages) if system_msgs
                                   else self.format_messages(messages))
             formatted_messages[-1]['content'] += response_format_prompt
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
             # Make API request without streaming
-            response = await self.client.chat.completions.create(
+            response = await self.create_completion(
                 model=self.model,
                 messages=formatted_messages,
-                max_tokens=self.max_tokens,
+                max_tokens=max_tokens or self.max_tokens,
                 temperature=temperature or self.temperature,
                 response_format={"type": "json_object"},
                 stream = stream,
                 extra_body={"enable_thinking": enable_thinking}
             )
             response_str = response.choices[0].message.content
+            finish_reason = response.choices[0].finish_reason
             print(response_str)
-            response_json = json.loads(response_str)
-
-            structured_output = response_format(**response_json)
+            if finish_reason == "length":
+                raise StructuredOutputError("Response truncated by max_tokens",
+                                            response_str or "", finish_reason)
+            try:
+                response_json = json.loads(response_str)
+                structured_output = response_format(**response_json)
+            except (json.JSONDecodeError, ValidationError, TypeError) as e:
+                raise StructuredOutputError(str(e), response_str or "",
+                                            finish_reason) from e
             if not structured_output:
                 raise ValueError("Empty response from LLM")
             return structured_output
-        except json.JSONDecodeError as je:
-            logger.error(f"JSONDecode error: {je}")
+        except StructuredOutputError as se:
+            logger.error(f"Structured output error: {se}")
             raise
         except ValueError as ve:
             logger.error(f"Value error: {ve}")
@@ -0,0 +1,325 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+import toml
+from loguru import logger
+from pydantic import BaseModel, Field
+
+from agent.deadline import DeadlineExceeded, remaining_time
+
+# 每写入多少次缓存清理一次过期数据
+_PURGE_EVERY_WRITES = 1000
+# 批量读写时单条 SQL 中 IN (...) 的最大参数个数
+_MAX_KEYS_PER_QUERY = 500
+
+
+class SharedSettings(BaseModel):
+    enabled: bool = Field(False, description="是否启用跨进程共享的缓存与限流")
+    path: str = Field("/tmp/dify_reqs_shared.db", description="SQLite 数据库文件路径，需位于本机磁盘")
+    rate_limit_rpm: float = Field(600, description="所有 worker 合计每分钟允许的 LLM 请求数，<=0 表示不限流")
+    rate_limit_burst: int = Field(20, description="令牌桶容量，即允许的瞬时并发请求数")
+    cache_ttl: float = Field(86400, description="共享缓存的过期时间（秒）")
+    lease_ttl: float = Field(120, description="同一缓存键计算中的租约时长（秒），超时后其它 worker 可接手")
+
+
+def load_shared_settings_from_toml(file_path: str) -> SharedSettings:
+    """
+    从 config.toml 文件的 [shared] 段加载 SharedSettings 实例。
+
+    :param file_path: config.toml 文件路径
+    :return: SharedSettings 实例
+    """
+    config = toml.load(file_path)
+    return SharedSettings(**config.get("shared", {}))
+
+
+class SharedStore:
+    """
+    基于 SQLite WAL 的本机跨进程存储，多个 uvicorn worker 打开同一个文件即可共享。
+    path 为 ":memory:" 时只在当前进程内生效。
+
+    每个进程持有一个连接，进程内的线程通过锁串行访问；
+    跨进程的写入由 SQLite 的文件锁与 BEGIN IMMEDIATE 事务保证原子性。
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path,
+                                     timeout=busy_timeout_ms / 1000,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS kv (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            CREATE INDEX IF NOT EXISTS kv_namespace_expires_at
+                ON kv (namespace, expires_at);
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS leases (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """在 BEGIN IMMEDIATE 事务中执行 func，提前拿到写锁避免读后写升级失败"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time())).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, orjson.dumps(value), now + ttl))
+            self._writes += 1
+            if self._writes % _PURGE_EVERY_WRITES == 0:
+                self._conn.execute("DELETE FROM kv WHERE expires_at <= ?",
+                                   (now, ))
+                self._conn.execute("DELETE FROM leases WHERE expires_at <= ?",
+                                   (now, ))
+
+    @staticmethod
+    def _select_many(conn: sqlite3.Connection, namespace: str,
+                     keys: List[str], now: float) -> Dict[str, Any]:
+        values = {}
+        for start in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+            chunk = keys[start:start + _MAX_KEYS_PER_QUERY]
+            # 过期时间在 Python 中过滤，让查询走 (namespace, key) 主键而不是
+            # (namespace, expires_at) 索引，否则耗时随 namespace 的条数增长
+            rows = conn.execute(
+                "SELECT key, value, expires_at FROM kv WHERE namespace = ? "
+                f"AND key IN ({', '.join('?' * len(chunk))})",
+                (namespace, *chunk)).fetchall()
+            values.update((key, orjson.loads(value))
+                          for key, value, expires_at in rows
+                          if expires_at > now)
+        return values
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """批量读取未过期的值，不存在的键不出现在结果中"""
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            return self._select_many(self._conn, namespace, keys, time.time())
+
+    def update_many(self, namespace: str, keys: Iterable[str],
+                    func: Callable[[str, Optional[Any]], Any],
+                    ttl: float) -> Dict[str, Any]:
+        """
+        在同一个事务中批量读改写：以 func(键, 未过期的旧值或 None) 的返回值写回。
+
+        :return: 写回的新值
+        """
+        keys = list(dict.fromkeys(keys))
+
+        def update(conn: sqlite3.Connection) -> Dict[str, Any]:
+            now = time.time()
+            current = self._select_many(conn, namespace, keys, now)
+            values = {key: func(key, current.get(key)) for key in keys}
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                [(namespace, key, orjson.dumps(value), now + ttl)
+                 for key, value in values.items()])
+            return values
+
+        return self._transaction(update)
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM kv WHERE namespace = ? AND expires_at > ?",
+                (namespace, time.time())).fetchone()[0]
+
+    def evict(self, namespace: str, max_entries: int) -> None:
+        """删除 namespace 中过期的条目，仍超过 max_entries 时从最早过期（最久未写入）的开始删除"""
+
+        def evict_expired_and_oldest(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM kv WHERE namespace = ? AND expires_at <= ?",
+                         (namespace, time.time()))
+            count = conn.execute("SELECT COUNT(*) FROM kv WHERE namespace = ?",
+                                 (namespace, )).fetchone()[0]
+            if count > max_entries:
+                conn.execute(
+                    "DELETE FROM kv WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM kv WHERE namespace = ? ORDER BY expires_at LIMIT ?)",
+                    (namespace, namespace, count - max_entries))
+
+        self._transaction(evict_expired_and_oldest)
+
+    def try_take_tokens(self, name: str, rate: float, capacity: float,
+                        tokens: float = 1.0) -> float:
+        """
+        从共享令牌桶取令牌。
+
+        :return: 0 表示已取到；否则为预计需要等待的秒数
+        """
+
+        def take(conn: sqlite3.Connection) -> float:
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM buckets WHERE name = ?",
+                (name, )).fetchone()
+            available = capacity if row is None else min(
+                capacity, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (name, available, now))
+            return wait
+
+        return self._transaction(take)
+
+    def try_acquire_lease(self, key: str, owner: str, ttl: float) -> bool:
+        """尝试获取 key 的计算租约，已被其它未过期的 owner 持有时返回 False"""
+
+        def acquire(conn: sqlite3.Connection) -> bool:
+            now = time.time()
+            row = conn.execute(
+                "SELECT owner, expires_at FROM leases WHERE key = ?",
+                (key, )).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, owner, now + ttl))
+            return True
+
+        return self._transaction(acquire)
+
+    def release_lease(self, key: str, owner: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?",
+                               (key, owner))
+
+
+class SharedRateLimiter:
+    """所有 worker 共用的全局令牌桶"""
+
+    def __init__(self,
+                 store: SharedStore,
+                 requests_per_minute: float,
+                 burst: int,
+                 name: str = "llm"):
+        self.store = store
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1, burst)
+        self.name = name
+
+    async def acquire(self) -> None:
+        """
+        等待直到取到令牌。
+
+        :raises DeadlineExceeded: 等待时间会超过当前请求的截止时间
+        """
+        while True:
+            wait = await asyncio.to_thread(self.store.try_take_tokens,
+                                           self.name, self.rate,
+                                           self.capacity)
+            if wait <= 0:
+                return
+            remaining = remaining_time()
+            if remaining is not None and remaining <= wait:
+                raise DeadlineExceeded("Request deadline exceeded while rate limited")
+            await asyncio.sleep(wait)
+
+
+class SharedCache:
+    """
+    跨 worker 共享的结果缓存，带租约的 single-flight：
+    同一个键同一时间只有一个 worker 调用模型，其它 worker 等待结果写入。
+    """
+
+    def __init__(self,
+                 store: SharedStore,
+                 ttl: float,
+                 lease_ttl: float,
+                 poll_interval: float = 0.2):
+        self.store = store
+        self.ttl = ttl
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self.store.get, namespace, key)
+
+    async def set(self, namespace: str, key: str, value: Any) -> None:
+        await asyncio.to_thread(self.store.set, namespace, key, value,
+                                self.ttl)
+
+    async def get_or_compute(
+            self, namespace: str, key: str,
+            compute: Callable[[], Awaitable[Tuple[Any, bool]]]
+    ) -> Tuple[Any, bool]:
+        """
+        读取共享缓存，未命中时获取租约并调用 compute。
+
+        :param compute: 返回 (结果, 是否可缓存) 的协程函数
+        :return: (结果, 是否可缓存)，命中缓存时可缓存为 True
+        """
+        lease_key = f"{namespace}:{key}"
+        owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        deadline = time.monotonic() + self.lease_ttl
+        while True:
+            value = await self.get(namespace, key)
+            if value is not None:
+                return value, True
+            acquired = await asyncio.to_thread(self.store.try_acquire_lease,
+                                               lease_key, owner,
+                                               self.lease_ttl)
+            if acquired or time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(self.poll_interval)
+
+        if not acquired:
+            logger.warning(f"等待共享缓存超时，自行计算：{lease_key}")
+        try:
+            value, cacheable = await compute()
+            if cacheable:
+                await self.set(namespace, key, value)
+            return value, cacheable
+        finally:
+            if acquired:
+                await asyncio.to_thread(self.store.release_lease, lease_key,
+                                        owner)
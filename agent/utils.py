@@ -18,5 +18,8 @@ def load_llm_settings_from_toml(file_path: str) -> LLMSettings:
         max_tokens=llm_config.get("max_tokens", 4096),
         temperature=llm_config.get("temperature", 1.0),
         api_type="",  # config.toml 中未定义，需手动设置或扩展
-        api_version=""  # config.toml 中未定义，需手动设置或扩展
+        api_version="",  # config.toml 中未定义，需手动设置或扩展
+        cassette_mode=llm_config.get("cassette_mode", ""),
+        cassette_dir=llm_config.get("cassette_dir", "cassettes"),
+        cassette_speed=llm_config.get("cassette_speed", 1.0)
     )
\ No newline at end of file
@@ -0,0 +1,133 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+import toml
+from pydantic import BaseModel, Field
+
+# 评论序列化为 json（indent=2）后字段名、引号、缩进以及 uid、时间、IP 等短字段
+# 带来的固定 token 开销（按约 260 个 ASCII 字符估算）
+COMMENT_OVERHEAD_TOKENS = 65
+# 一个 token 大约对应的 ASCII 字符数；中文等非 ASCII 字符按一个字符一个 token 估算
+ASCII_CHARS_PER_TOKEN = 4.0
+
+
+class BudgetSettings(BaseModel):
+    max_prompt_tokens: int = Field(
+        30000, description="评论列表在 prompt 中允许占用的最大 token 数，<=0 表示不限制")
+    engagement_weight: float = Field(0.5, description="互动（点赞、回复）权重")
+    recency_weight: float = Field(0.3, description="发布时间新近程度权重")
+    length_weight: float = Field(0.2, description="评论长度权重")
+    length_saturation: int = Field(
+        50, description="评论长度达到该字符数后长度得分不再增加")
+
+
+def load_budget_settings_from_toml(file_path: str) -> BudgetSettings:
+    """
+    从 config.toml 文件的 [budget] 段加载 BudgetSettings 实例。
+
+    :param file_path: config.toml 文件路径
+    :return: BudgetSettings 实例
+    """
+    config = toml.load(file_path)
+    return BudgetSettings(**config.get("budget", {}))
+
+
+def _min_max(values: pd.Series) -> pd.Series:
+    values = values.astype(float)
+    span = values.max() - values.min()
+    if not np.isfinite(span) or span <= 0:
+        return pd.Series(np.zeros(len(values)), index=values.index)
+    return (values - values.min()) / span
+
+
+def _text_tokens(text: object) -> float:
+    if not isinstance(text, str):
+        return 0.0
+    # 中文等常见非 ASCII 字符在 UTF-8 中占 3 字节，由字节数与字符数推算其个数
+    wide = (len(text.encode("utf-8")) - len(text)) / 2
+    return wide + (len(text) - wide) / ASCII_CHARS_PER_TOKEN
+
+
+def estimate_comment_tokens(comment_list: List[dict]) -> np.ndarray:
+    """估算每条评论序列化后占用的 token 数：评论内容按字符估算，其余字段按固定开销"""
+    return np.fromiter(
+        (COMMENT_OVERHEAD_TOKENS + _text_tokens(comment.get("comment_content"))
+         for comment in comment_list),
+        dtype=float,
+        count=len(comment_list))
+
+
+def _recency(comment_time: pd.Series) -> pd.Series:
+    """发布时间的百分位排名；统一转换为 UTC 比较，无法解析时所有评论按 0 分处理"""
+    try:
+        parsed = pd.to_datetime(comment_time,
+                                errors="coerce",
+                                format="ISO8601",
+                                utc=True)
+        return parsed.rank(pct=True, method="average").fillna(0)
+    except (TypeError, ValueError):
+        return pd.Series(np.zeros(len(comment_time)), index=comment_time.index)
+
+
+def compute_priority(comment_list: List[dict],
+                     settings: BudgetSettings) -> np.ndarray:
+    """
+    计算每条评论的优先级：互动、新近程度与长度三项各自归一化到 [0, 1] 后加权求和。
+    缺失的字段按 0 分处理。
+    """
+
+    def column(name: str) -> pd.Series:
+        return pd.Series([comment.get(name) for comment in comment_list],
+                         dtype=object)
+
+    like_count = pd.to_numeric(column("like_count"),
+                               errors="coerce").fillna(0).clip(lower=0)
+    response_count = pd.to_numeric(column("response_count"),
+                                   errors="coerce").fillna(0).clip(lower=0)
+    engagement = _min_max(np.log1p(like_count) + np.log1p(response_count))
+
+    recency = _recency(column("comment_time").map(
+        lambda value: value if isinstance(value, str) else None))
+
+    content_len = pd.Series([
+        len(content) if isinstance(content, str) else 0
+        for content in (comment.get("comment_content")
+                        for comment in comment_list)
+    ], dtype=float)
+    length = (content_len / max(settings.length_saturation, 1)).clip(upper=1.0)
+
+    priority = (settings.engagement_weight * engagement +
+                settings.recency_weight * recency +
+                settings.length_weight * length)
+    return priority.to_numpy(dtype=float)
+
+
+def fit_prompt_budget(comment_list: List[dict],
+                      settings: BudgetSettings) -> List[dict]:
+    """
+    评论总量超过 token 预算时，按优先级从高到低贪心填充预算。
+
+    :param comment_list: 经过 preprocess 的评论列表
+    :param settings: 预算与优先级权重配置
+    :return: 预算内的评论，保持原有顺序；未超预算时原样返回
+    """
+    if settings.max_prompt_tokens <= 0 or not comment_list:
+        return comment_list
+
+    tokens = estimate_comment_tokens(comment_list)
+    if tokens.sum() <= settings.max_prompt_tokens:
+        return comment_list
+
+    # 按优先级依次放入，放不下的评论跳过，后面更短的评论仍可能放得下
+    priority = compute_priority(comment_list, settings)
+    remaining = float(settings.max_prompt_tokens)
+    keep = []
+    for i in np.argsort(-priority, kind="stable"):
+        if tokens[i] <= remaining:
+            keep.append(i)
+            remaining -= tokens[i]
+            if remaining < COMMENT_OVERHEAD_TOKENS:
+                break
+    keep.sort()
+    return [comment_list[i] for i in keep]
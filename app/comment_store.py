@@ -0,0 +1,105 @@
+import argparse
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.process_xlsx import frame_to_video_dict
+
+# 分区列：按行业分目录，按视频ID 过滤时依赖行组统计信息跳过无关数据
+PARTITION_COLUMN = "行业"
+VIDEO_ID_COLUMN = "视频ID"
+
+# 写入 parquet 的列及类型，ID 类列统一存为字符串
+_STORE_SCHEMA = pa.schema([
+    (VIDEO_ID_COLUMN, pa.string()),
+    (PARTITION_COLUMN, pa.string()),
+    ("关键字", pa.string()),
+    ("评论内容", pa.string()),
+    ("创建时间", pa.string()),
+    ("IP未知", pa.string()),
+    ("回复数", pa.int64()),
+    ("点赞数", pa.int64()),
+    ("UID", pa.string()),
+])
+
+
+def convert_xlsx_to_parquet(file_path: str,
+                            store_dir: str,
+                            max_rows_per_group: int = 10000) -> int:
+    """
+    将导出的 .xlsx 转换为按行业分区的 parquet 评论库。
+
+    写入前按 行业、视频ID 排序，使每个行组的视频ID 范围尽量小，
+    读取时按视频ID 过滤即可借助行组统计信息跳过无关数据。
+    已存在的同行业分区会被覆盖。
+
+    :param file_path: Excel 文件路径
+    :param store_dir: parquet 评论库目录
+    :param max_rows_per_group: 每个行组的最大行数
+    :return: 写入的评论条数
+    """
+    df = pd.read_excel(file_path)
+    df = df[[field.name for field in _STORE_SCHEMA]]
+    for column in (VIDEO_ID_COLUMN, PARTITION_COLUMN, "关键字", "创建时间", "UID"):
+        df[column] = df[column].astype(str)
+    df["IP未知"] = df["IP未知"].map(
+        lambda value: None if pd.isna(value) else str(value))
+    # 非字符串的评论内容在 preprocess 中会被过滤，这里存为空值以保持相同的结果
+    df["评论内容"] = df["评论内容"].map(
+        lambda value: value if isinstance(value, str) else None)
+    df = df.sort_values([PARTITION_COLUMN, VIDEO_ID_COLUMN], kind="stable")
+
+    table = pa.Table.from_pandas(df, schema=_STORE_SCHEMA, preserve_index=False)
+    pq.write_to_dataset(table,
+                        root_path=store_dir,
+                        partition_cols=[PARTITION_COLUMN],
+                        existing_data_behavior="delete_matching",
+                        max_rows_per_group=max_rows_per_group)
+    return table.num_rows
+
+
+def extract_comments_from_store(store_dir: str,
+                                video_ids: Optional[List[str]] = None,
+                                industries: Optional[List[str]] = None) -> dict:
+    """
+    从 parquet 评论库读取评论，返回结构与 extract_comments_by_video_id 相同。
+
+    行业过滤只读取对应分区目录，视频ID 过滤下推到行组统计信息，
+    文件以 memory map 方式读取。
+
+    :param store_dir: parquet 评论库目录
+    :param video_ids: 只读取这些视频ID，None 表示全部
+    :param industries: 只读取这些行业，None 表示全部
+    :return: {视频ID: 视频信息与评论列表}
+    """
+    filters = []
+    if video_ids:
+        filters.append((VIDEO_ID_COLUMN, "in", [str(v) for v in video_ids]))
+    if industries:
+        filters.append((PARTITION_COLUMN, "in", list(industries)))
+
+    table = pq.read_table(store_dir,
+                          filters=filters or None,
+                          memory_map=True,
+                          partitioning="hive")
+    df = table.to_pandas()
+    df[PARTITION_COLUMN] = df[PARTITION_COLUMN].astype(str)
+    return frame_to_video_dict(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="将 Excel 导出转换为 parquet 评论库")
+    parser.add_argument("--file_path",
+                        type=str,
+                        default="./demo_data/output.xlsx",
+                        help="Excel 文件路径")
+    parser.add_argument("--store_dir",
+                        type=str,
+                        default="./demo_data/comment_store",
+                        help="parquet 评论库目录")
+    args = parser.parse_args()
+
+    row_num = convert_xlsx_to_parquet(args.file_path, args.store_dir)
+    print(f"转换完成，共写入评论数：{row_num}")
@@ -1,5 +1,5 @@
-from typing import Optional, List
-from pydantic import BaseModel, Field
+from typing import Dict, Optional, List
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import datetime
 
 
@@ -29,3 +29,16 @@ class HighIntentCommentList(BaseModel):
     表示一条被识别为高意向的评论及其理由。
     """
     high_intent_comment_list: List[HighIntentComment] = Field(..., description="高意向评论列表")
+
+
+class CommentScoreList(BaseModel):
+    """
+    表示模型对评论意向程度的分档打分结果。
+    """
+    scores: Dict[str, int] = Field(..., description="评论 UID 到意向分档（0~3）的映射，分档为 0 的评论可省略")
+
+
+# 预编译的校验器，避免每次请求重复构建 pydantic schema
+COMMENT_ADAPTER = TypeAdapter(Comment)
+COMMENT_LIST_ADAPTER = TypeAdapter(List[Comment])
+HIGH_INTENT_COMMENT_ADAPTER = TypeAdapter(HighIntentComment)
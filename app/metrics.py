@@ -0,0 +1,22 @@
+from collections import Counter
+from typing import Dict
+
+
+class RequestMetrics:
+    """
+    进程内的请求计数。
+
+    多 worker 部署时每个 worker 各自计数。
+    """
+
+    def __init__(self):
+        self._counters: Counter = Counter()
+
+    def inc(self, name: str, value: int = 1) -> None:
+        self._counters[name] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self._counters)
+
+
+metrics = RequestMetrics()
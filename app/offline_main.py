@@ -1,80 +1,469 @@
 import json
 import time
+import hashlib
 import asyncio
 import argparse
-from typing import List, Optional
+from typing import (Any, Awaitable, Callable, Dict, Iterable, List, Optional,
+                    Tuple, Type)
 from loguru import logger
+from pydantic import BaseModel, ValidationError
 
 from app.process_xlsx import extract_comments_by_video_id
-from app.comments import Comment, HighIntentCommentList
-from app.prompts import SYSTEM_PROMPT_TEMPL, USER_PROMPT_TEMPL
+from app.comment_store import extract_comments_from_store
+from app.comments import (COMMENT_ADAPTER, HIGH_INTENT_COMMENT_ADAPTER, Comment,
+                          CommentScoreList, HighIntentComment,
+                          HighIntentCommentList)
+from app.prompts import (PROMPT_VERSION, SCORE_SYSTEM_PROMPT_TEMPL,
+                         SYSTEM_PROMPT_TEMPL, USER_PROMPT_TEMPL)
+from app.budget import fit_prompt_budget, load_budget_settings_from_toml
+from app.ranking import ScoreCache, make_video_key, normalize_scores, top_k_by_score
 from app.preprocess import is_valid_uid, preprocess
+from app.profiling import stage
+from app.verdict_index import (VerdictIndex, load_verdict_settings_from_toml,
+                               make_video_id, select_known_high_intent)
 from agent.utils import load_llm_settings_from_toml
-from agent.llm import LLM
+from agent.llm import LLM, StructuredOutputError
+from agent.cassette import Cassette
+from agent.deadline import DeadlineExceeded, deadline_scope
+from agent.json_repair import repair_partial_json
+from agent.shared_state import (SharedCache, SharedRateLimiter, SharedStore,
+                                load_shared_settings_from_toml)
 from agent.data_format import Message
 
 llm_settings = load_llm_settings_from_toml("agent/config.toml")
-llm = LLM(llm_settings)
+budget_settings = load_budget_settings_from_toml("agent/config.toml")
+
+# 多 worker 部署时共享缓存与全局限流，未启用时各进程独立运行
+shared_settings = load_shared_settings_from_toml("agent/config.toml")
+shared_store = SharedStore(
+    shared_settings.path) if shared_settings.enabled else None
+shared_cache = SharedCache(
+    shared_store, shared_settings.cache_ttl,
+    shared_settings.lease_ttl) if shared_store is not None else None
+rate_limiter = SharedRateLimiter(
+    shared_store, shared_settings.rate_limit_rpm,
+    shared_settings.rate_limit_burst) if (
+        shared_store is not None and shared_settings.rate_limit_rpm > 0) else None
+llm = LLM(llm_settings, rate_limiter=rate_limiter)
+
+
+def make_cache_namespace(namespace: str, response_format: Type[BaseModel]) -> str:
+    """
+    共享缓存的命名空间，包含模型、采样温度、prompt 版本与输出 schema，
+    任一变化后不再命中持久化的旧结果。
+    """
+    schema = json.dumps(response_format.model_json_schema(),
+                        ensure_ascii=False,
+                        sort_keys=True)
+    version = "\0".join(
+        [llm.model, str(llm.temperature), PROMPT_VERSION, schema])
+    return f"{namespace}:{hashlib.sha1(version.encode('utf-8')).hexdigest()[:12]}"
+
+
+PICK_CACHE_NAMESPACE = make_cache_namespace("pick", HighIntentCommentList)
+SCORE_CACHE_NAMESPACE = make_cache_namespace("scores", CommentScoreList)
+
+# 补充请求每条高意向评论预留的输出 token 数
+FOLLOWUP_MAX_TOKENS_PER_COMMENT = 256
+
+# 打分模式下按视频缓存的评论分档
+score_cache = ScoreCache()
+
+# 跨视频复用的评论判定，识别反复出现的刷屏模板与已判定过的评论；
+# 启用共享存储时所有 worker 共用同一份判定，否则只在进程内生效
+verdict_settings = load_verdict_settings_from_toml("agent/config.toml")
+verdict_index = VerdictIndex(
+    verdict_settings, shared_store if shared_store is not None else
+    SharedStore(":memory:")) if verdict_settings.enabled else None
+
+
+def recover_high_intent_comments(
+        raw_response: str) -> List[HighIntentComment]:
+    """
+    从被截断或部分不合法的模型输出中恢复每一条完整的 HighIntentComment。
+
+    :param raw_response: 模型返回的原始文本
+    :return: 校验通过的高意向评论列表
+    """
+    try:
+        response_json = repair_partial_json(raw_response)
+    except json.JSONDecodeError as je:
+        logger.error(f"JSON repair failed: {je}")
+        return []
+
+    if isinstance(response_json, dict):
+        items = response_json.get("high_intent_comment_list", [])
+    else:
+        items = response_json
+    if not isinstance(items, list):
+        return []
+
+    high_intent_comments = []
+    for item in items:
+        try:
+            high_intent_comments.append(
+                HIGH_INTENT_COMMENT_ADAPTER.validate_python(item))
+        except ValidationError:
+            logger.warning(f"high_intent_comment is unvalid: {item}")
+    return high_intent_comments
+
+
+async def ask_high_intent_comments(
+        vedio_info: str,
+        comment_list: List[dict],
+        high_intent_comment_num: int,
+        max_tokens: Optional[int] = None
+) -> Tuple[List[HighIntentComment], bool]:
+    """
+    请求模型选出高意向评论。
+
+    模型输出残缺或不合法时，不直接放弃整次调用，而是尽量恢复其中完整的
+    HighIntentComment 条目。
+
+    :return: (模型选出的高意向评论（可能少于 high_intent_comment_num 条）, 输出是否完整)
+    """
+    with stage("render"):
+        comment_list_str = json.dumps(comment_list,
+                                      ensure_ascii=False,
+                                      indent=2)
+        messages = [
+            Message.user_message(
+                USER_PROMPT_TEMPL.render(vedio_info=vedio_info,
+                                         comment_list=comment_list_str))
+        ]
+        system_msgs = [
+            Message.system_message(
+                SYSTEM_PROMPT_TEMPL.render(
+                    high_intent_comment_num=high_intent_comment_num))
+        ]
+    try:
+        with stage("llm"):
+            response = await llm.ask_structure_output(
+                messages=messages,
+                response_format=HighIntentCommentList,
+                system_msgs=system_msgs,
+                max_tokens=max_tokens)
+        return response.high_intent_comment_list, True
+    except StructuredOutputError as se:
+        with stage("parse"):
+            high_intent_comments = recover_high_intent_comments(
+                se.raw_response)
+        logger.warning(f"模型输出不完整，恢复高意向评论 {len(high_intent_comments)} 条")
+        return high_intent_comments, False
+
+
+def collect_comments(high_intent_comments: List[HighIntentComment],
+                     comment_dict: dict, result: List[Comment],
+                     high_intent_comment_num: int) -> None:
+    """将模型选出的 uid 映射回原始评论并追加到 result，跳过无效与重复的 uid"""
+    picked_uids = {comment.uid for comment in result}
+    for high_intent_comment in high_intent_comments:
+        if len(result) >= high_intent_comment_num:
+            break
+        if not is_valid_uid(high_intent_comment.uid) or \
+                high_intent_comment.uid not in comment_dict:
+            logger.warning(
+                f"high_intent_comment is unvalid: {high_intent_comment}")
+            continue
+        if high_intent_comment.uid in picked_uids:
+            continue
+        try:
+            result.append(
+                COMMENT_ADAPTER.validate_python(
+                    comment_dict[high_intent_comment.uid]))
+            picked_uids.add(high_intent_comment.uid)
+        except ValidationError as ve:
+            logger.warning(f"comment is unvalid: {ve}")
+
+
+async def ask_comment_scores(vedio_info: str,
+                             comment_list: List[dict]) -> Tuple[Dict[str, int], bool]:
+    """
+    请求模型对每条评论的意向程度分档打分。
+
+    :return: (评论 UID 到分档的映射, 输出是否完整)。输出残缺时返回修复出的部分分档
+    """
+    with stage("render"):
+        comment_list_str = json.dumps(comment_list,
+                                      ensure_ascii=False,
+                                      indent=2)
+        messages = [
+            Message.user_message(
+                USER_PROMPT_TEMPL.render(vedio_info=vedio_info,
+                                         comment_list=comment_list_str))
+        ]
+        system_msgs = [
+            Message.system_message(SCORE_SYSTEM_PROMPT_TEMPL.render())
+        ]
+    try:
+        with stage("llm"):
+            response = await llm.ask_structure_output(
+                messages=messages,
+                response_format=CommentScoreList,
+                system_msgs=system_msgs)
+        return normalize_scores(response.scores), True
+    except StructuredOutputError as se:
+        with stage("parse"):
+            response_json = repair_partial_json(se.raw_response)
+        scores = response_json.get("scores") if isinstance(
+            response_json, dict) else None
+        if not isinstance(scores, dict):
+            raise
+        scores = normalize_scores(scores)
+        logger.warning(f"模型输出不完整，恢复评论分档 {len(scores)} 条")
+        return scores, False
+
+
+async def cached_compute(
+        namespace: str, key: str,
+        compute: Callable[[], Awaitable[Tuple[Any, bool]]]) -> Tuple[Any, bool]:
+    """启用共享缓存时跨 worker 复用结果并合并同一个键的并发计算，否则直接计算"""
+    if shared_cache is None:
+        return await compute()
+    return await shared_cache.get_or_compute(namespace, key, compute)
+
+
+async def pick_high_intent_comments(vedio_info: str, comment_list: List[dict],
+                                    comment_dict: Dict[str, dict],
+                                    high_intent_comment_num: int,
+                                    video_id: str) -> List[Comment]:
+    """挑选模式：模型直接返回 high_intent_comment_num 条高意向评论，结果按视频与条数缓存"""
+
+    async def compute() -> Tuple[List[str], bool]:
+        result = await ask_and_collect_comments(vedio_info, comment_list,
+                                                comment_dict,
+                                                high_intent_comment_num)
+        # 只记录模型新给出的判定，缓存命中时不重复累积置信度
+        if verdict_index is not None:
+            await asyncio.to_thread(
+                verdict_index.record_high_intent,
+                [comment_dict[comment.uid] for comment in result], video_id)
+        return [comment.uid for comment in result], len(
+            result) == high_intent_comment_num
+
+    response_key = f"{make_video_key(vedio_info, comment_list)}:{high_intent_comment_num}"
+    uids, _ = await cached_compute(PICK_CACHE_NAMESPACE, response_key, compute)
+    result = []
+    with stage("parse"):
+        for uid in uids:
+            try:
+                result.append(
+                    COMMENT_ADAPTER.validate_python(comment_dict[uid]))
+            except (KeyError, ValidationError) as e:
+                logger.warning(f"comment is unvalid: {e}")
+    return result
+
+
+def uncovered_comments(comment_list: List[dict],
+                       returned_uids: Iterable[str]) -> List[dict]:
+    """
+    残缺输出中模型还没有处理到的评论。
+
+    prompt 要求按评论列表顺序输出，最后一条出现在输出中的评论及之前的评论视为已处理。
+    """
+    returned_uids = set(returned_uids)
+    last_index = -1
+    for index, comment in enumerate(comment_list):
+        if comment['uid'] in returned_uids:
+            last_index = index
+    return comment_list[last_index + 1:]
+
+
+async def ask_and_collect_comments(vedio_info: str, comment_list: List[dict],
+                                   comment_dict: Dict[str, dict],
+                                   high_intent_comment_num: int) -> List[Comment]:
+    """
+    请求模型挑选高意向评论。
+
+    输出被截断或需要修复且结果不足时，只把模型还没处理到的评论
+    交给一次补充请求，请求缺少的条数。
+    """
+    high_intent_comments, complete = await ask_high_intent_comments(
+        vedio_info=vedio_info,
+        comment_list=comment_list,
+        high_intent_comment_num=high_intent_comment_num)
+    result = []
+    with stage("parse"):
+        collect_comments(high_intent_comments, comment_dict, result,
+                         high_intent_comment_num)
+
+    # 完整输出但条数不足说明模型没有找到更多高意向评论，不再追加请求
+    missing_num = high_intent_comment_num - len(result)
+    if missing_num > 0 and not complete:
+        rest_comment_list = uncovered_comments(
+            comment_list,
+            [comment.uid for comment in high_intent_comments])
+        if not rest_comment_list:
+            return result
+        logger.info(f"高意向评论缺少 {missing_num} 条，对未处理的 "
+                    f"{len(rest_comment_list)}/{len(comment_list)} 条评论发起补充请求")
+        followup_comments, _ = await ask_high_intent_comments(
+            vedio_info=vedio_info,
+            comment_list=rest_comment_list,
+            high_intent_comment_num=missing_num,
+            max_tokens=min(llm.max_tokens,
+                           FOLLOWUP_MAX_TOKENS_PER_COMMENT * missing_num))
+        with stage("parse"):
+            collect_comments(followup_comments, comment_dict, result,
+                             high_intent_comment_num)
+    return result
+
+
+async def rank_high_intent_comments(vedio_info: str, comment_list: List[dict],
+                                    comment_dict: Dict[str, dict],
+                                    high_intent_comment_num: int,
+                                    video_id: str) -> List[Comment]:
+    """
+    打分模式：模型对每条评论分档，分档按视频缓存，
+    之后任意条数的请求都在缓存分档上做 top-k，不再调用模型。
+    """
+    video_key = make_video_key(vedio_info, comment_list)
+    scores = score_cache.get(video_key)
+    if scores is None:
+
+        async def compute() -> Tuple[Dict[str, int], bool]:
+            scores, complete = await ask_comment_scores(vedio_info, comment_list)
+            # 输出残缺时只对模型还没处理到的评论补充打分一次
+            rest_comment_list = [] if complete else uncovered_comments(
+                comment_list, scores)
+            if rest_comment_list:
+                logger.info(f"评论分档不完整，对未处理的 "
+                            f"{len(rest_comment_list)}/{len(comment_list)} 条评论补充打分")
+                followup_scores, complete = await ask_comment_scores(
+                    vedio_info, rest_comment_list)
+                scores = {**followup_scores, **scores}
+            if complete and verdict_index is not None:
+                await asyncio.to_thread(verdict_index.record_scores,
+                                        comment_list, scores, video_id)
+            return scores, complete
+
+        scores, complete = await cached_compute(SCORE_CACHE_NAMESPACE, video_key,
+                                                compute)
+        # 残缺的分档不缓存，避免之后的请求一直拿到不完整的排序
+        if complete:
+            score_cache.set(video_key, scores)
+    else:
+        logger.info(f"命中评论分档缓存：{video_key}")
+
+    result = []
+    with stage("parse"):
+        for comment in top_k_by_score(scores, comment_dict,
+                                      high_intent_comment_num):
+            if not is_valid_uid(comment['uid']):
+                logger.warning(f"comment uid is unvalid: {comment['uid']}")
+                continue
+            try:
+                result.append(COMMENT_ADAPTER.validate_python(comment))
+            except ValidationError as ve:
+                logger.warning(f"comment is unvalid: {ve}")
+    return result
 
 
 async def get_high_intent_commemts(
-        vedio_info: str, comment_list: List[dict],
-        high_intent_comment_num: int) -> List[Comment]:
-
-    before_comment_len = len(comment_list)
-    comment_list = preprocess(comment_list)
-    logger.info(f"过滤前评论数：{(before_comment_len)} 过滤后评论数：{len(comment_list)}")
-    # logger.info(f"前 5 条评论：{comment_list[:5]}")
-    comment_list_str = json.dumps(comment_list, ensure_ascii=False, indent=2)
-
-    comment_dict = {}
-    for comment in comment_list:
-        comment_dict[comment['uid']] = Comment(**comment)
-    messages = [
-        Message.user_message(
-            USER_PROMPT_TEMPL.render(vedio_info=vedio_info,
-                                     comment_list=comment_list_str))
-    ]
-
-    high_intent_comment_num = min(high_intent_comment_num,
-                                  int(0.5 * len(comment_list)))
+        vedio_info: str,
+        comment_list: List[dict],
+        high_intent_comment_num: int,
+        mode: str = "pick",
+        timeout: Optional[float] = None,
+        vedio_id: Optional[str] = None) -> List[Comment]:
+    """
+    获取高意向评论。
+
+    :param mode: "pick" 由模型直接挑选指定条数；"score" 由模型分档打分，
+        分档按视频缓存，不同条数的请求复用同一次模型调用
+    :param timeout: 本次处理的时间预算（秒），会传递到模型调用的超时与重试策略
+    :param vedio_id: 视频ID，跨视频复用判定时用于区分视频，None 时按 vedio_info 区分
+    :raises DeadlineExceeded: 超过时间预算
+    """
+    with deadline_scope(timeout):
+        return await _get_high_intent_commemts(
+            vedio_info, comment_list, high_intent_comment_num, mode,
+            make_video_id(vedio_info, vedio_id))
+
+
+async def _get_high_intent_commemts(vedio_info: str, comment_list: List[dict],
+                                    high_intent_comment_num: int, mode: str,
+                                    video_id: str) -> List[Comment]:
+
+    with stage("preprocess"):
+        before_comment_len = len(comment_list)
+        comment_list = preprocess(comment_list)
+        logger.info(f"过滤前评论数：{(before_comment_len)} 过滤后评论数：{len(comment_list)}")
+        # logger.info(f"前 5 条评论：{comment_list[:5]}")
+
+        # 已知的刷屏与本视频低意向评论直接剔除，已知高意向评论直接计入结果
+        known_comments = []
+        if verdict_index is not None:
+            await asyncio.to_thread(verdict_index.observe, comment_list,
+                                    video_id)
+            before_comment_len = len(comment_list)
+            comment_list, known_comments = await asyncio.to_thread(
+                verdict_index.short_circuit, comment_list, video_id)
+            # 已知高意向评论按文本去重，最多占结果的一半，其余仍交给模型判断
+            known_comments, rest_known_comments = select_known_high_intent(
+                known_comments, max(1, high_intent_comment_num // 2))
+            comment_list = comment_list + rest_known_comments
+            if len(comment_list) < before_comment_len:
+                logger.info(
+                    f"复用已知判定：剔除 {before_comment_len - len(comment_list) - len(known_comments)} 条，"
+                    f"已知高意向 {len(known_comments)} 条")
+
+        # 评论过多时按互动、新近程度与长度的优先级填充 prompt 预算
+        before_comment_len = len(comment_list)
+        comment_list = fit_prompt_budget(comment_list, budget_settings)
+        if len(comment_list) < before_comment_len:
+            logger.info(f"超出 prompt 预算，保留高优先级评论：{len(comment_list)}/{before_comment_len}")
+
+        # 仅保存原始 dict，返回时才校验为 Comment，通常只需校验 high_intent_comment_num 条
+        comment_dict = {}
+        for comment in known_comments + comment_list:
+            comment_dict[comment['uid']] = comment
+
+    high_intent_comment_num = min(
+        high_intent_comment_num,
+        int(0.5 * (len(comment_list) + len(known_comments))))
     if high_intent_comment_num <= 0:
         logger.error(f"comment is too few")
         return []
 
-    try:
-        response = await llm.ask_structure_output(
-            messages=messages,
-            response_format=HighIntentCommentList,
-            system_msgs=[
-                Message.system_message(
-                    SYSTEM_PROMPT_TEMPL.render(
-                        high_intent_comment_num=high_intent_comment_num))
-            ])
-
-        result = []
-        for high_intent_comment in response.high_intent_comment_list:
-            if is_valid_uid(high_intent_comment.uid):
-                if high_intent_comment.uid not in comment_dict.keys():
-                    logger.warning(
-                        f"high_intent_comment is unvalid: {high_intent_comment}"
-                    )
-                else:
-                    result.append(comment_dict[high_intent_comment.uid])
-            else:
-                logger.warning(
-                    f"high_intent_comment is unvalid: {high_intent_comment}")
+    result = []
+    for comment in known_comments[:high_intent_comment_num]:
+        try:
+            result.append(COMMENT_ADAPTER.validate_python(comment))
+        except ValidationError as e:
+            logger.warning(f"comment is unvalid: {e}")
+    remaining_num = high_intent_comment_num - len(result)
+    if remaining_num <= 0 or not comment_list:
         return result
+
+    try:
+        if mode == "score":
+            return result + await rank_high_intent_comments(
+                vedio_info, comment_list, comment_dict, remaining_num,
+                video_id)
+        return result + await pick_high_intent_comments(
+            vedio_info, comment_list, comment_dict, remaining_num, video_id)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Error:{e}")
-        return []
+        return result
 
 
 async def main(args):
     file_path = args.file_path
-    data = extract_comments_by_video_id(file_path)
-    llm_settings = load_llm_settings_from_toml("agent/config.toml")
-    llm = LLM(llm_settings)
+    if args.store_dir:
+        # 直接读取 parquet 评论库，只加载指定的视频与行业
+        data = extract_comments_from_store(
+            args.store_dir,
+            video_ids=args.video_ids.split(",") if args.video_ids else None,
+            industries=args.industries.split(",") if args.industries else None)
+    else:
+        data = extract_comments_by_video_id(file_path)
+    if args.cassette_mode:
+        # 录制/回放模型调用，回放时无需网络即可复现整条处理流程
+        llm.cassette = Cassette(args.cassette_mode, args.cassette_dir,
+                                args.cassette_speed)
 
     for vedio_id, v in data.items():
         start_time = time.time()
@@ -84,7 +473,9 @@ async def main(args):
         result = await get_high_intent_commemts(
             vedio_info=vedio_info,
             comment_list=comment_list,
-            high_intent_comment_num=args.high_intent_comment_num)
+            high_intent_comment_num=args.high_intent_comment_num,
+            mode=args.mode,
+            vedio_id=vedio_id)
 
         for res in result:
             logger.info(res.model_dump_json())
@@ -97,10 +488,40 @@ if __name__ == "__main__":
                         type=str,
                         default="./demo_data/output.xlsx",
                         help="Excel 文件路径")
+    parser.add_argument("--store_dir",
+                        type=str,
+                        default="",
+                        help="parquet 评论库目录（由 app/comment_store.py 转换生成），设置后不再读取 Excel")
+    parser.add_argument("--video_ids",
+                        type=str,
+                        default="",
+                        help="只处理这些视频ID，逗号分隔，仅对 --store_dir 生效")
+    parser.add_argument("--industries",
+                        type=str,
+                        default="",
+                        help="只处理这些行业，逗号分隔，仅对 --store_dir 生效")
     parser.add_argument("--high_intent_comment_num",
                         type=int,
                         default=5,
                         help="高意向评论条数")
+    parser.add_argument("--mode",
+                        type=str,
+                        default="pick",
+                        choices=["pick", "score"],
+                        help="pick: 模型直接挑选；score: 模型分档打分后按条数取 top-k")
+    parser.add_argument("--cassette_mode",
+                        type=str,
+                        default="",
+                        choices=["", "record", "replay"],
+                        help="record: 录制模型调用；replay: 从录制结果回放，不访问网络")
+    parser.add_argument("--cassette_dir",
+                        type=str,
+                        default="cassettes",
+                        help="cassette 目录")
+    parser.add_argument("--cassette_speed",
+                        type=float,
+                        default=1.0,
+                        help="回放倍速，<=0 表示不等待录制时的耗时")
     args = parser.parse_args()
 
     asyncio.run(main(args))
@@ -4,30 +4,36 @@ import pandas as pd
 
 def extract_comments_by_video_id(file_path: str) -> dict:
     df = pd.read_excel(file_path)
+    return frame_to_video_dict(df)
+
+
+def frame_to_video_dict(df: pd.DataFrame) -> dict:
+    """
+    将导出表格的 DataFrame 按视频ID 分组为 {视频ID: 视频信息与评论列表}。
+
+    按列整体转换后再分组，避免逐行 iterrows。
+    """
+    comment_records = pd.DataFrame({
+        "comment_content": df['评论内容'],
+        # "user_name": df['用户名称'],
+        "comment_time": df['创建时间'].astype(str),
+        "ip_address": df['IP未知'],
+        "response_count": df['回复数'].astype(int),
+        "like_count": df['点赞数'].astype(int),
+        "uid": df['UID'].astype(str)
+    }).to_dict("records")
+    video_ids = df['视频ID'].astype(str)
 
     result = {}
-
-    for _, row in df.iterrows():
-        video_id = str(row['视频ID'])
-        vedeo_info ={
+    for video_id, indices in video_ids.groupby(video_ids,
+                                               sort=False).indices.items():
+        first = indices[0]
+        result[video_id] = {
             "vedio_id": video_id,
-            "industry": row["行业"],
-            "keyword": row["关键字"]
-        }
-        comment_info = {
-            "comment_content": row['评论内容'],
-            # "user_name": row['用户名称'],
-            "comment_time": str(row['创建时间']),
-            "ip_address": row['IP未知'],
-            "response_count": int(row['回复数']),
-            "like_count": int(row['点赞数']),
-            "uid": str(row['UID'])
+            "industry": df["行业"].iat[first],
+            "keyword": df["关键字"].iat[first],
+            "comment_list": [comment_records[i] for i in indices]
         }
-        if video_id not in result:
-            result[video_id] = vedeo_info
-            result[video_id]["comment_list"] = [comment_info]
-        else:
-            result[video_id]["comment_list"].append(comment_info)
 
     return result
 
@@ -37,4 +43,3 @@ def dict_to_json(data: dict, save_file_path: str) -> None:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
     print("提取完成，共处理视频ID数：", len(data))
-
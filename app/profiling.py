@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+import orjson
+import toml
+from loguru import logger
+from pydantic import BaseModel, Field
+
+
+class ProfilingSettings(BaseModel):
+    enabled: bool = Field(False, description="是否允许通过请求头或参数对单个请求采样")
+    output_dir: str = Field("profiles", description="采样结果与阶段耗时的保存目录")
+    interval_ms: float = Field(5.0, description="采样间隔（毫秒）")
+
+
+def load_profiling_settings_from_toml(file_path: str) -> ProfilingSettings:
+    """
+    从 config.toml 文件的 [profiling] 段加载 ProfilingSettings 实例。
+
+    :param file_path: config.toml 文件路径
+    :return: ProfilingSettings 实例
+    """
+    config = toml.load(file_path)
+    return ProfilingSettings(**config.get("profiling", {}))
+
+
+class RequestProfile:
+    """
+    单个请求的采样 profile。
+
+    后台线程按固定间隔采样事件循环线程的调用栈，栈底加上当前阶段名，
+    结束后保存为 collapsed-stack 文件（可直接用 flamegraph.pl / speedscope 打开），
+    同目录下保存各阶段耗时的 json。
+
+    采样的是整个事件循环线程，同一时间并发的其它请求也会被采到，
+    排查时应尽量在低并发下对单个请求采样。
+    """
+
+    def __init__(self, output_dir: str, interval_ms: float = 5.0):
+        self.profile_id = uuid.uuid4().hex
+        self.output_dir = output_dir
+        self.interval = interval_ms / 1000
+        self.current_stage = "other"
+        self.stage_timings: Dict[str, float] = {}
+        self.samples: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop_event = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._start_time = 0.0
+        self.total_time = 0.0
+
+    def start(self) -> None:
+        self._start_time = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample_loop,
+                                         name=f"profiler-{self.profile_id}",
+                                         daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.total_time = time.perf_counter() - self._start_time
+
+    def _sample_loop(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            stack.append(self.current_stage)
+            self.samples[";".join(reversed(stack))] += 1
+
+    def add_stage_time(self, name: str, elapsed: float) -> None:
+        self.stage_timings[name] = self.stage_timings.get(name, 0.0) + elapsed
+
+    def save(self) -> str:
+        """保存 collapsed-stack 与阶段耗时，返回 collapsed-stack 文件路径"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_path = os.path.join(self.output_dir, self.profile_id)
+        with open(f"{base_path}.collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(f"{base_path}.json", "wb") as f:
+            f.write(
+                orjson.dumps(
+                    {
+                        "profile_id": self.profile_id,
+                        "total_time": self.total_time,
+                        "stage_timings": self.stage_timings,
+                        "sample_count": sum(self.samples.values()),
+                        "interval_ms": self.interval * 1000,
+                    },
+                    option=orjson.OPT_INDENT_2))
+        logger.info(f"profile saved: {base_path}.collapsed")
+        return f"{base_path}.collapsed"
+
+
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar(
+    "current_profile", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """标记处理阶段；当前请求未开启 profile 时几乎没有开销"""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    previous_stage = profile.current_stage
+    profile.current_stage = name
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_stage_time(name, time.perf_counter() - start_time)
+        profile.current_stage = previous_stage
@@ -1,3 +1,6 @@
+import hashlib
+from pathlib import Path
+
 from jinja2 import Template
 
 
@@ -11,6 +14,7 @@ SYSTEM_PROMPT_TEMPL = Template("""
 - 提出个人具体情况，如“我孩子三岁可以吗”、“适合我这种情况吗”
                                
 要求返回高意向的评论的条数：{{ high_intent_comment_num }}
+按评论在评论列表中的顺序返回。
                                
 """)
 
@@ -19,4 +23,26 @@ USER_PROMPT_TEMPL = Template("""
 
 评论列表：{{ comment_list }}
                             
-""")
\ No newline at end of file
+""")
+
+SCORE_SYSTEM_PROMPT_TEMPL = Template("""
+
+你是一位评论审核专家，你需要对评论列表中每条评论相对视频内容的意向程度进行分档打分。
+
+高意向评论的特点包括但不限于：
+- 明确询问服务或产品的信息，如“多少钱”、“怎么预约”、“在哪”
+- 表达明确兴趣，如“我想了解”、“我也想试试”、“适合我吗”
+- 提出个人具体情况，如“我孩子三岁可以吗”、“适合我这种情况吗”
+
+分档标准：
+- 3：明确的购买或咨询意向
+- 2：表达了兴趣或提出了个人具体情况
+- 1：与视频内容相关，有潜在意向
+- 0：无意向（无需返回）
+
+只返回分档大于 0 的评论，按评论在评论列表中的顺序输出，格式为 {"scores": {"评论 UID": 分档}}，不要输出理由。
+
+""")
+
+# prompt 模板的版本：修改本文件中任一模板后随之变化，用于区分共享缓存中的旧结果
+PROMPT_VERSION = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()[:12]
@@ -0,0 +1,97 @@
+import heapq
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# 意向分档范围：0 表示无意向，3 表示明确的购买或咨询意向
+INTENT_SCORE_MIN = 0
+INTENT_SCORE_MAX = 3
+# 计为高意向评论的最低分档；1 档只是与视频相关的潜在意向，不用于凑满条数
+HIGH_INTENT_SCORE_MIN = 2
+
+
+def make_video_key(vedio_info: str, comment_list: List[dict]) -> str:
+    """
+    根据视频信息与评论 UID 集合生成视频缓存键。
+
+    同一视频、同一批评论在不同 k 下请求时得到相同的键。
+    """
+    hasher = hashlib.sha1(vedio_info.encode("utf-8"))
+    for uid in sorted(str(comment["uid"]) for comment in comment_list):
+        hasher.update(b"\0")
+        hasher.update(uid.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def normalize_scores(scores: Dict[str, object]) -> Dict[str, int]:
+    """过滤非整数分档并截断到 [INTENT_SCORE_MIN, INTENT_SCORE_MAX]"""
+    normalized = {}
+    for uid, score in scores.items():
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            continue
+        normalized[str(uid)] = max(INTENT_SCORE_MIN,
+                                   min(INTENT_SCORE_MAX, int(score)))
+    return normalized
+
+
+def _to_count(value: object) -> float:
+    """将互动数转换为非负数值，无法转换时按 0 处理（与 app/budget.py 一致）"""
+    try:
+        count = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    if not math.isfinite(count):
+        return 0.0
+    return max(count, 0.0)
+
+
+def top_k_by_score(scores: Dict[str, int], comment_dict: Dict[str, dict],
+                   k: int) -> List[dict]:
+    """
+    基于缓存的分档做 top-k 选择。
+
+    仅考虑分档不低于 HIGH_INTENT_SCORE_MIN 且存在于 comment_dict 中的评论，
+    不足 k 条时返回的条数少于 k（与挑选模式一致）；分档相同时按
+    like_count、response_count 降序排序（字符串等按数值比较，无法转换时按 0），
+    仍相同时保持 scores 中的顺序。
+
+    :param scores: 评论 UID 到分档的映射
+    :param comment_dict: 评论 UID 到原始评论 dict 的映射
+    :param k: 返回条数
+    :return: 原始评论 dict 列表，按排名降序
+    """
+    candidates = []
+    for uid, score in scores.items():
+        comment = comment_dict.get(uid)
+        if score < HIGH_INTENT_SCORE_MIN or comment is None:
+            continue
+        candidates.append((score, _to_count(comment.get("like_count")),
+                           _to_count(comment.get("response_count")), uid))
+    top_k = heapq.nlargest(k, candidates, key=lambda item: item[:3])
+    return [comment_dict[item[3]] for item in top_k]
+
+
+class ScoreCache:
+    """
+    按视频缓存评论意向分档，容量满时淘汰最久未使用的视频。
+    """
+
+    def __init__(self, max_videos: int = 1024):
+        self.max_videos = max_videos
+        self._cache: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+
+    def get(self, video_key: str) -> Optional[Dict[str, int]]:
+        scores = self._cache.get(video_key)
+        if scores is not None:
+            self._cache.move_to_end(video_key)
+        return scores
+
+    def set(self, video_key: str, scores: Dict[str, int]) -> None:
+        self._cache[video_key] = scores
+        self._cache.move_to_end(video_key)
+        while len(self._cache) > self.max_videos:
+            self._cache.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._cache)
@@ -1,17 +1,48 @@
-from fastapi import FastAPI, Body
-from pydantic import BaseModel, Field
-from typing import List
+import asyncio
+
+import orjson
+import toml
+from fastapi import FastAPI, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import List, Literal, Optional
 from datetime import datetime
+from loguru import logger
 
-from app.comments import Comment
+from app.comments import COMMENT_LIST_ADAPTER, Comment
+from app.metrics import metrics
 from app.offline_main import get_high_intent_commemts
+from app.profiling import (RequestProfile, current_profile,
+                           load_profiling_settings_from_toml, stage)
 from agent.utils import load_llm_settings_from_toml
 from agent.llm import LLM
+from agent.deadline import Deadline, DeadlineExceeded
 from agent.data_format import Message
 
 llm_settings = load_llm_settings_from_toml("agent/config.toml")
 llm = LLM(llm_settings)
-app = FastAPI()
+profiling_settings = load_profiling_settings_from_toml("agent/config.toml")
+
+
+class ServerSettings(BaseModel):
+    request_timeout: float = Field(120, description="单个请求的默认时间预算（秒），也是允许的上限")
+    disconnect_poll_interval: float = Field(0.5, description="检查客户端是否断开的间隔（秒）")
+
+
+def load_server_settings_from_toml(file_path: str) -> ServerSettings:
+    """
+    从 config.toml 文件的 [server] 段加载 ServerSettings 实例。
+
+    :param file_path: config.toml 文件路径
+    :return: ServerSettings 实例
+    """
+    config = toml.load(file_path)
+    return ServerSettings(**config.get("server", {}))
+
+
+server_settings = load_server_settings_from_toml("agent/config.toml")
+app = FastAPI(default_response_class=ORJSONResponse)
 
 class HighIntentRequest(BaseModel):
     vedio_info: str
@@ -19,14 +50,148 @@ class HighIntentRequest(BaseModel):
     high_intent_comment_num: int = Field(
         5, gt=0, description="希望返回的高意向评论数量，默认为 5"
     )
+    mode: Literal["pick", "score"] = Field(
+        "pick", description="pick: 模型直接挑选；score: 模型分档打分，同一视频不同数量的请求复用打分结果"
+    )
+    vedio_id: Optional[str] = Field(
+        None, description="视频ID，启用跨视频判定复用时用于区分视频，不传时按 vedio_info 区分"
+    )
+
+
+HIGH_INTENT_REQUEST_ADAPTER = TypeAdapter(HighIntentRequest)
+
+# 客户端主动断开时返回的状态码（沿用 nginx 的 499）
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnected(Exception):
+    """客户端在处理完成前断开了连接"""
+
+
+def request_timeout(request: Request) -> float:
+    """请求的时间预算：请求头 X-Request-Timeout（秒）只能在配置值内缩短"""
+    timeout = server_settings.request_timeout
+    header = request.headers.get("X-Request-Timeout")
+    if header:
+        try:
+            timeout = min(timeout, max(float(header), 0.0))
+        except ValueError:
+            logger.warning(f"invalid X-Request-Timeout: {header}")
+    return timeout
+
+
+async def wait_or_cancel(request: Request, task: asyncio.Task,
+                         timeout: float):
+    """
+    等待处理任务完成，期间定期检查客户端是否断开；
+    客户端断开或超过时间预算时取消任务，停止仍在进行的模型调用与重试。
+    """
+    deadline = Deadline(timeout)
+    try:
+        while True:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise DeadlineExceeded("Request deadline exceeded")
+            done, _ = await asyncio.wait(
+                {task},
+                timeout=min(server_settings.disconnect_poll_interval,
+                            remaining))
+            if task in done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    except BaseException:
+        if not task.done():
+            task.cancel()
+            metrics.inc("llm_tasks_cancelled")
+        raise
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
 
 # ---- FastAPI 路由封装 ----
 
-@app.post("/get_high_intent_comments", response_model=List[Comment])
-async def get_high_intent_comments_api(req: HighIntentRequest = Body(...)):
-    result = await get_high_intent_commemts(
-        vedio_info=req.vedio_info,
-        comment_list=req.comment_list,
-        high_intent_comment_num=req.high_intent_comment_num
-    )
-    return result
+# 请求体由 orjson 解析并用预编译的 TypeAdapter 校验，跳过 FastAPI 默认的 Body 解析；
+# openapi_extra 保留接口文档中的请求体 schema
+@app.post("/get_high_intent_comments",
+          response_model=List[Comment],
+          openapi_extra={
+              "requestBody": {
+                  "content": {
+                      "application/json": {
+                          "schema": HighIntentRequest.model_json_schema()
+                      }
+                  },
+                  "required": True,
+              }
+          })
+async def get_high_intent_comments_api(request: Request):
+    metrics.inc("requests_total")
+    # 请求头 X-Profile: 1 或参数 ?profile=1 且配置开启时，对本次请求采样
+    if not profiling_settings.enabled or not wants_profile(request):
+        return await handle_high_intent_request(request)
+
+    profile = RequestProfile(profiling_settings.output_dir,
+                             profiling_settings.interval_ms)
+    token = current_profile.set(profile)
+    profile.start()
+    try:
+        response = await handle_high_intent_request(request)
+    finally:
+        profile.stop()
+        current_profile.reset(token)
+        profile.save()
+    response.headers["X-Profile-Id"] = profile.profile_id
+    return response
+
+
+def wants_profile(request: Request) -> bool:
+    flag = request.headers.get("X-Profile") or request.query_params.get(
+        "profile")
+    return flag is not None and flag.lower() in ("1", "true")
+
+
+async def handle_high_intent_request(request: Request) -> ORJSONResponse:
+    with stage("decode"):
+        try:
+            req = HIGH_INTENT_REQUEST_ADAPTER.validate_python(
+                orjson.loads(await request.body()))
+        except orjson.JSONDecodeError as je:
+            raise RequestValidationError([{
+                "type": "json_invalid",
+                "loc": ("body", ),
+                "msg": f"JSON decode error: {je}",
+                "input": {},
+            }])
+        except ValidationError as ve:
+            raise RequestValidationError([{
+                **error, "loc": ("body", *error["loc"])
+            } for error in ve.errors(include_url=False)])
+
+    timeout = request_timeout(request)
+    task = asyncio.create_task(
+        get_high_intent_commemts(
+            vedio_info=req.vedio_info,
+            comment_list=req.comment_list,
+            high_intent_comment_num=req.high_intent_comment_num,
+            mode=req.mode,
+            timeout=timeout,
+            vedio_id=req.vedio_id
+        ))
+    try:
+        result = await wait_or_cancel(request, task, timeout)
+    except ClientDisconnected:
+        metrics.inc("requests_cancelled_disconnect")
+        logger.warning("client disconnected, llm task cancelled")
+        return ORJSONResponse({"detail": "Client disconnected"},
+                              status_code=CLIENT_CLOSED_REQUEST)
+    except (DeadlineExceeded, asyncio.TimeoutError):
+        metrics.inc("requests_deadline_exceeded")
+        logger.warning(f"request exceeded its {timeout}s budget, llm task cancelled")
+        return ORJSONResponse({"detail": "Request deadline exceeded"},
+                              status_code=504)
+    with stage("encode"):
+        return ORJSONResponse(COMMENT_LIST_ADAPTER.dump_python(result))
@@ -0,0 +1,316 @@
+import hashlib
+import re
+import time
+import unicodedata
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+import toml
+from pydantic import BaseModel, Field
+
+from agent.shared_state import SharedStore
+
+SPAM = "spam"
+HIGH_INTENT = "high_intent"
+LOW_INTENT = "low_intent"
+
+# 单个视频给出的判定置信度，同一判定来自不同视频时按 1 - Π(1 - c) 累积；
+# 同一视频重复给出的判定不累积
+SPAM_CONFIDENCE = 0.9
+PICKED_CONFIDENCE = 0.6
+SCORE_CONFIDENCE = {0: 0.6, 2: 0.5, 3: 0.6}
+
+# 每条判定最多记录多少个给出判定的视频
+_MAX_VERDICT_VIDEOS = 16
+# 每写入多少条判定淘汰一次过期与超量的条目
+_EVICT_EVERY_WRITES = 1000
+
+# 刷屏与高意向判定按文本 / UID 跨视频共享；低意向判定只在同一视频内复用
+_TEXT_NAMESPACE = "verdict:text"
+_UID_NAMESPACE = "verdict:uid"
+_VIDEO_TEXT_NAMESPACE = "verdict:video_text"
+_NAMESPACES = (_TEXT_NAMESPACE, _UID_NAMESPACE, _VIDEO_TEXT_NAMESPACE)
+
+_NON_WORD_PATTERN = re.compile(r"[\W_]+")
+_MENTION_PATTERN = re.compile(r"@\S+")
+_EMOJI_PATTERN = re.compile(r"\[[^\[\]]{1,8}\]")
+
+
+class VerdictSettings(BaseModel):
+    enabled: bool = Field(False, description="是否跨视频复用评论判定")
+    max_entries: int = Field(200000, description="文本、UID 与视频内文本索引各自的最大条数（约）")
+    max_age: float = Field(7 * 86400, description="判定的有效期（秒）")
+    spam_min_videos: int = Field(3, description="同一模板文本出现在多少个不同视频中视为刷屏")
+    min_template_length: int = Field(
+        8, description="归一化后达到该长度的文本才参与模板刷屏与跨视频高意向判定")
+    min_confidence: float = Field(0.8, description="置信度达到该值的跨视频判定才会跳过模型")
+
+
+def load_verdict_settings_from_toml(file_path: str) -> VerdictSettings:
+    """
+    从 config.toml 文件的 [verdict] 段加载 VerdictSettings 实例。
+
+    :param file_path: config.toml 文件路径
+    :return: VerdictSettings 实例
+    """
+    config = toml.load(file_path)
+    return VerdictSettings(**config.get("verdict", {}))
+
+
+# observe 与 short_circuit 会对同一批评论各归一化一次
+@lru_cache(maxsize=65536)
+def normalize_comment_text(text: str) -> str:
+    """归一化评论文本：去掉 @提及、[表情]、空白与标点，统一全半角与大小写"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _MENTION_PATTERN.sub("", text)
+    text = _EMOJI_PATTERN.sub("", text)
+    return _NON_WORD_PATTERN.sub("", text)
+
+
+def make_video_id(vedio_info: str, vedio_id: Optional[str] = None) -> str:
+    """
+    视频身份：优先使用视频ID，没有时使用视频信息的哈希。
+
+    与评论集合无关，同一视频追加评论后再次请求仍是同一个视频。
+    """
+    if vedio_id:
+        return f"id:{vedio_id}"
+    return "info:" + hashlib.sha1(vedio_info.encode("utf-8")).hexdigest()
+
+
+def select_known_high_intent(
+        known_comments: List[dict],
+        limit: int) -> Tuple[List[dict], List[dict]]:
+    """
+    已知高意向评论按归一化文本去重后最多取 limit 条。
+
+    :return: (直接计入结果的评论, 仍交给模型判断的评论)
+    """
+    selected, rest, seen_texts = [], [], set()
+    for comment in known_comments:
+        text_key = normalize_comment_text(comment["comment_content"])
+        if len(selected) < limit and text_key not in seen_texts:
+            selected.append(comment)
+            seen_texts.add(text_key)
+        else:
+            rest.append(comment)
+    return selected, rest
+
+
+def _apply_verdict(record: Optional[dict], verdict: str, confidence: float,
+                   video_id: str, now: float) -> dict:
+    """在 record 上叠加 video_id 给出的一次判定，返回新的 record"""
+    record = dict(record) if record else {"verdict": None, "confidence": 0.0}
+    verdict_videos = list(record.get("verdict_videos", []))
+    if record["verdict"] != verdict:
+        record["verdict"] = verdict
+        record["confidence"] = confidence
+        verdict_videos = [video_id]
+    elif video_id not in verdict_videos:
+        record["confidence"] = 1 - (1 - record["confidence"]) * (1 - confidence)
+        verdict_videos = (verdict_videos + [video_id])[-_MAX_VERDICT_VIDEOS:]
+    else:
+        return record
+    record["verdict_videos"] = verdict_videos
+    record["updated_at"] = now
+    return record
+
+
+class VerdictIndex:
+    """
+    跨视频的评论判定索引，保存在 SharedStore 中。
+
+    - 同一模板文本出现在多个不同视频中时判定为刷屏，其 UID 一并标记；
+    - 模型挑选或打分为高意向的评论按文本（达到 min_template_length）与 UID 记录，
+      只有来自不同视频的判定才累积置信度；
+    - 模型打分为低意向（0 档）的评论只按视频与文本记录，不影响其它视频；
+    - 再次遇到判定时跳过模型：置信度足够的刷屏评论与本视频的低意向评论直接剔除，
+      置信度足够的高意向评论作为候选直接计入结果。
+
+    只在出现新视频或新判定时写入，超过 max_age 未写入的条目过期；
+    每写入一定条数后淘汰过期条目，并在索引超过 max_entries 时从最久未写入的开始淘汰。
+    使用多个 worker 共用的 SharedStore 时，所有 worker 看到同一份判定。
+    """
+
+    def __init__(self, settings: VerdictSettings, store: SharedStore):
+        self.settings = settings
+        self.store = store
+        self._writes = 0
+
+    def __len__(self) -> int:
+        return sum(self.store.count(namespace) for namespace in _NAMESPACES)
+
+    def evict(self) -> None:
+        for namespace in _NAMESPACES:
+            self.store.evict(namespace, self.settings.max_entries)
+
+    def _write(self, namespace: str, keys: List[str],
+               func: Callable[[str, Optional[dict]], dict]) -> Dict[str, dict]:
+        if not keys:
+            return {}
+        records = self.store.update_many(namespace, keys, func,
+                                         self.settings.max_age)
+        before = self._writes
+        self._writes += len(records)
+        if self._writes // _EVICT_EVERY_WRITES > before // _EVICT_EVERY_WRITES:
+            self.evict()
+        return records
+
+    def _record(self, namespace: str, confidences: Dict[str, float],
+                verdict: str, video_id: str) -> None:
+        now = time.time()
+        self._write(
+            namespace, list(confidences), lambda key, record: _apply_verdict(
+                record, verdict, confidences[key], video_id, now))
+
+    def _verdict(self, record: Optional[dict], now: float,
+                 min_confidence: float) -> Optional[str]:
+        if record is None or record["verdict"] is None:
+            return None
+        if now - record["updated_at"] > self.settings.max_age:
+            return None
+        if record["confidence"] < min_confidence:
+            return None
+        return record["verdict"]
+
+    @staticmethod
+    def _video_text_key(video_id: str, text_key: str) -> str:
+        return f"{video_id}|{text_key}"
+
+    def observe(self, comment_list: List[dict], video_id: str) -> None:
+        """记录模板文本出现在哪些视频中，跨视频重复达到阈值时判定为刷屏"""
+        uids_by_text: Dict[str, List[str]] = {}
+        for comment in comment_list:
+            text_key = normalize_comment_text(comment["comment_content"])
+            if len(text_key) >= self.settings.min_template_length:
+                uids_by_text.setdefault(text_key, []).append(str(comment["uid"]))
+        if not uids_by_text:
+            return
+
+        def needs_video(record: Optional[dict]) -> bool:
+            if record is None:
+                return True
+            videos = record.get("videos", [])
+            return video_id not in videos and \
+                len(videos) < self.settings.spam_min_videos
+
+        # 先在事务外读取，只有出现新视频的文本才进入写事务
+        records = self.store.get_many(_TEXT_NAMESPACE, uids_by_text)
+        now = time.time()
+
+        def add_video(_, record: Optional[dict]) -> dict:
+            if not needs_video(record):
+                return record
+            record = dict(record) if record else {
+                "verdict": None, "confidence": 0.0, "updated_at": now
+            }
+            record["videos"] = record.get("videos", []) + [video_id]
+            if len(record["videos"]) >= self.settings.spam_min_videos and \
+                    record["verdict"] != HIGH_INTENT:
+                record = _apply_verdict(record, SPAM, SPAM_CONFIDENCE,
+                                        video_id, now)
+            return record
+
+        records.update(
+            self._write(_TEXT_NAMESPACE, [
+                text_key for text_key in uids_by_text
+                if needs_video(records.get(text_key))
+            ], add_video))
+
+        spam_uids = [
+            uid for text_key, uids in uids_by_text.items()
+            if (records.get(text_key) or {}).get("verdict") == SPAM
+            for uid in uids
+        ]
+        uid_records = self.store.get_many(_UID_NAMESPACE, spam_uids)
+        self._record(
+            _UID_NAMESPACE, {
+                uid: SPAM_CONFIDENCE
+                for uid in spam_uids
+                if (uid_records.get(uid) or {}).get("verdict") != SPAM
+            }, SPAM, video_id)
+
+    def short_circuit(self, comment_list: List[dict],
+                      video_id: str) -> Tuple[List[dict], List[dict]]:
+        """
+        用已知判定筛选评论。
+
+        :return: (仍需模型判断的评论, 已知高意向评论)；已知刷屏与本视频的低意向评论被剔除
+        """
+        text_keys = [
+            normalize_comment_text(comment["comment_content"])
+            for comment in comment_list
+        ]
+        video_text_keys = [
+            self._video_text_key(video_id, text_key) for text_key in text_keys
+        ]
+        uid_records = self.store.get_many(
+            _UID_NAMESPACE, [str(comment["uid"]) for comment in comment_list])
+        text_records = self.store.get_many(_TEXT_NAMESPACE, text_keys)
+        video_text_records = self.store.get_many(_VIDEO_TEXT_NAMESPACE,
+                                                 video_text_keys)
+
+        now = time.time()
+        min_confidence = self.settings.min_confidence
+        remaining, known_high_intent = [], []
+        for comment, text_key, video_text_key in zip(comment_list, text_keys,
+                                                     video_text_keys):
+            uid_verdict = self._verdict(uid_records.get(str(comment["uid"])),
+                                        now, min_confidence)
+            text_verdict = self._verdict(text_records.get(text_key), now,
+                                         min_confidence)
+            # 本视频内的低意向判定是模型对同一视频同一文本的结论，不要求跨视频累积
+            video_verdict = self._verdict(
+                video_text_records.get(video_text_key), now, 0.0)
+            if SPAM in (uid_verdict, text_verdict) or video_verdict == LOW_INTENT:
+                continue
+            if text_verdict == HIGH_INTENT and \
+                    len(text_key) >= self.settings.min_template_length:
+                known_high_intent.append(comment)
+            else:
+                remaining.append(comment)
+        return remaining, known_high_intent
+
+    def _record_high_intent(self, confidences: Dict[Tuple[str, str], float],
+                            video_id: str) -> None:
+        text_confidences, uid_confidences = {}, {}
+        for (text_key, uid), confidence in confidences.items():
+            if len(text_key) >= self.settings.min_template_length:
+                text_confidences.setdefault(text_key, confidence)
+            uid_confidences[uid] = confidence
+        self._record(_TEXT_NAMESPACE, text_confidences, HIGH_INTENT, video_id)
+        self._record(_UID_NAMESPACE, uid_confidences, HIGH_INTENT, video_id)
+
+    def record_high_intent(self,
+                           comment_list: List[dict],
+                           video_id: str,
+                           confidence: float = PICKED_CONFIDENCE) -> None:
+        """记录模型在 video_id 中挑选出的高意向评论"""
+        self._record_high_intent(
+            {(normalize_comment_text(comment["comment_content"]),
+              str(comment["uid"])): confidence
+             for comment in comment_list}, video_id)
+
+    def record_scores(self, comment_list: List[dict], scores: Dict[str, int],
+                      video_id: str) -> None:
+        """
+        记录打分模式下模型实际给出的分档：0 档为本视频内的低意向，2、3 档为高意向。
+
+        模型没有给出分档的评论不记录。
+        """
+        high_intent, low_video_texts = {}, {}
+        for comment in comment_list:
+            uid = str(comment["uid"])
+            score = scores.get(uid)
+            if score not in SCORE_CONFIDENCE:
+                continue
+            text_key = normalize_comment_text(comment["comment_content"])
+            if score > 0:
+                high_intent[(text_key, uid)] = SCORE_CONFIDENCE[score]
+            elif text_key:
+                low_video_texts.setdefault(
+                    self._video_text_key(video_id, text_key),
+                    SCORE_CONFIDENCE[0])
+        self._record_high_intent(high_intent, video_id)
+        self._record(_VIDEO_TEXT_NAMESPACE, low_video_texts, LOW_INTENT,
+                     video_id)
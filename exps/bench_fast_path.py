@@ -0,0 +1,79 @@
+import json
+import time
+import random
+import argparse
+from typing import List
+
+import orjson
+
+from app.comments import COMMENT_ADAPTER, COMMENT_LIST_ADAPTER, Comment
+from app.server import HIGH_INTENT_REQUEST_ADAPTER, HighIntentRequest
+
+
+def build_payload(comment_num: int) -> bytes:
+    comment_list = []
+    for i in range(comment_num):
+        comment_list.append({
+            "comment_content": f"这门课程多少钱？我想了解一下 {i}",
+            "comment_time": "2023-10-02 14:30:00",
+            "ip_address": "上海",
+            "response_count": random.randint(0, 50),
+            "like_count": random.randint(0, 500),
+            "uid": str(10000000 + i)
+        })
+    payload = {
+        "vedio_info": "行业: 教育 关键字: 在线学习",
+        "comment_list": comment_list,
+        "high_intent_comment_num": 5
+    }
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def baseline_path(body: bytes, picked_uids: List[str]) -> bytes:
+    """旧路径：json 解析 + 模型校验，全量构建 Comment，默认 json 序列化响应"""
+    req = HighIntentRequest(**json.loads(body))
+    comment_dict = {}
+    for comment in req.comment_list:
+        comment_dict[comment['uid']] = Comment(**comment)
+    result = [comment_dict[uid] for uid in picked_uids]
+    return json.dumps([c.model_dump(mode="json") for c in result],
+                      ensure_ascii=False).encode("utf-8")
+
+
+def fast_path(body: bytes, picked_uids: List[str]) -> bytes:
+    """新路径：orjson 解析 + 预编译 TypeAdapter，仅校验返回的评论"""
+    req = HIGH_INTENT_REQUEST_ADAPTER.validate_python(orjson.loads(body))
+    comment_dict = {}
+    for comment in req.comment_list:
+        comment_dict[comment['uid']] = comment
+    result = [
+        COMMENT_ADAPTER.validate_python(comment_dict[uid])
+        for uid in picked_uids
+    ]
+    return orjson.dumps(COMMENT_LIST_ADAPTER.dump_python(result))
+
+
+def bench(func, body: bytes, picked_uids: List[str], repeat: int) -> float:
+    func(body, picked_uids)  # warm up
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func(body, picked_uids)
+    return (time.perf_counter() - start_time) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="请求/响应快速路径的 CPU 耗时对比")
+    parser.add_argument("--comment_num", type=int, default=10000, help="评论条数")
+    parser.add_argument("--repeat", type=int, default=20, help="重复次数")
+    args = parser.parse_args()
+
+    body = build_payload(args.comment_num)
+    picked_uids = [str(10000000 + i) for i in range(0, args.comment_num, args.comment_num // 5)][:5]
+
+    baseline_cost = bench(baseline_path, body, picked_uids, args.repeat)
+    fast_cost = bench(fast_path, body, picked_uids, args.repeat)
+    print(f"评论条数: {args.comment_num}")
+    print(f"baseline: {baseline_cost * 1000:.2f} ms/request")
+    print(f"fast path: {fast_cost * 1000:.2f} ms/request")
+    print(f"saved: {(baseline_cost - fast_cost) * 1000:.2f} ms/request "
+          f"({baseline_cost / fast_cost:.1f}x)")
@@ -0,0 +1,80 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing as mp
+
+from agent.shared_state import SharedCache, SharedRateLimiter, SharedStore
+
+
+def worker(path: str, rpm: float, burst: int, duration: float,
+           start_at: float, queue: mp.Queue) -> None:
+    """单个 worker：在 duration 内持续向全局令牌桶取令牌，并读写共享缓存"""
+    store = SharedStore(path)
+    limiter = SharedRateLimiter(store, rpm, burst)
+    cache = SharedCache(store, ttl=60, lease_ttl=10)
+
+    async def run():
+        admitted = 0
+        cache_ops = 0
+        cache_latency = 0.0
+        while time.time() < start_at:
+            await asyncio.sleep(0.001)
+        end_at = start_at + duration
+        while time.time() < end_at:
+            op_start = time.perf_counter()
+            await cache.set("bench", f"{os.getpid()}:{cache_ops % 100}",
+                            {"scores": {"10000001": 3}})
+            await cache.get("bench", f"{os.getpid()}:{cache_ops % 100}")
+            cache_latency += time.perf_counter() - op_start
+            cache_ops += 1
+
+            wait = store.try_take_tokens(limiter.name, limiter.rate,
+                                         limiter.capacity)
+            if wait <= 0:
+                admitted += 1
+        return admitted, cache_ops, cache_latency
+
+    queue.put(asyncio.run(run()))
+    store.close()
+
+
+def bench(worker_num: int, rpm: float, burst: int, duration: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "shared.db")
+        SharedStore(path).close()
+
+        queue = mp.Queue()
+        start_at = time.time() + 1.0
+        processes = [
+            mp.Process(target=worker,
+                       args=(path, rpm, burst, duration, start_at, queue))
+            for _ in range(worker_num)
+        ]
+        for process in processes:
+            process.start()
+        results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    admitted = sum(r[0] for r in results)
+    cache_ops = sum(r[1] for r in results)
+    cache_latency = sum(r[2] for r in results)
+    allowed = burst + rpm / 60 * duration
+    print(f"workers={worker_num:>2} "
+          f"admitted={admitted} (quota {allowed:.0f}) "
+          f"cache_ops/s={cache_ops / duration:.0f} "
+          f"cache_get+set={cache_latency / max(cache_ops, 1) * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="跨进程共享缓存与全局令牌桶压测")
+    parser.add_argument("--workers", type=str, default="1,4,16", help="worker 数列表")
+    parser.add_argument("--rpm", type=float, default=600, help="全局每分钟请求数")
+    parser.add_argument("--burst", type=int, default=20, help="令牌桶容量")
+    parser.add_argument("--duration", type=float, default=5.0, help="每组压测时长（秒）")
+    args = parser.parse_args()
+
+    for worker_num in [int(n) for n in args.workers.split(",")]:
+        bench(worker_num, args.rpm, args.burst, args.duration)
@@ -0,0 +1,54 @@
+from app.budget import BudgetSettings, estimate_comment_tokens, fit_prompt_budget
+
+
+def build_comment_list():
+    return [
+        {"comment_content": "好", "uid": "10000001", "comment_time": "2023-10-01 12:00:00",
+         "like_count": 0, "response_count": 0},
+        {"comment_content": "这个课程多少钱，怎么报名？", "uid": "10000002",
+         "comment_time": "2023-10-03 12:00:00", "like_count": 100, "response_count": 10},
+        {"comment_content": "我家孩子三岁可以学吗", "uid": "10000003",
+         "comment_time": "2023-10-02 12:00:00", "like_count": 20, "response_count": 2},
+    ]
+
+
+def test_within_budget_returns_original():
+    comment_list = build_comment_list()
+    assert fit_prompt_budget(comment_list, BudgetSettings()) is comment_list
+
+
+def test_budget_keeps_high_priority_in_original_order():
+    comment_list = build_comment_list()
+    tokens = estimate_comment_tokens(comment_list)
+    settings = BudgetSettings(max_prompt_tokens=int(tokens[1] + tokens[2]) + 1)
+    result = fit_prompt_budget(comment_list, settings)
+    assert [c["uid"] for c in result] == ["10000002", "10000003"]
+
+
+def test_missing_optional_fields():
+    comment_list = [{"comment_content": "多少钱" * i, "uid": str(10000000 + i)}
+                    for i in range(1, 6)]
+    tokens = estimate_comment_tokens(comment_list)
+    settings = BudgetSettings(max_prompt_tokens=int(tokens[3] + tokens[4]) + 1)
+    result = fit_prompt_budget(comment_list, settings)
+    assert [c["uid"] for c in result] == ["10000004", "10000005"]
+
+
+def test_greedy_fill_skips_comments_that_do_not_fit():
+    comment_list = build_comment_list()
+    comment_list[2] = dict(comment_list[2], comment_content="我家孩子三岁可以学吗" * 20)
+    tokens = estimate_comment_tokens(comment_list)
+    # 优先级第二的长评论放不下，优先级最低的短评论仍然放入
+    settings = BudgetSettings(max_prompt_tokens=int(tokens[0] + tokens[1]) + 1)
+    result = fit_prompt_budget(comment_list, settings)
+    assert [c["uid"] for c in result] == ["10000001", "10000002"]
+
+
+def test_mixed_timezone_comment_time():
+    comment_list = [{"comment_content": "多少钱" * i, "uid": str(10000000 + i),
+                     "comment_time": ("2023-10-02 14:30:00" if i % 2 else
+                                      "2023-10-02T14:30:00+08:00"),
+                     "like_count": i, "response_count": 0}
+                    for i in range(1, 401)]
+    result = fit_prompt_budget(comment_list, BudgetSettings(max_prompt_tokens=5000))
+    assert 0 < len(result) < len(comment_list)
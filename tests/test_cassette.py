@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from agent.cassette import Cassette, CassetteMissError
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "qwen-turbo-latest",
+    "choices": [{
+        "index": 0,
+        "finish_reason": "stop",
+        "message": {"role": "assistant", "content": "{\"scores\": {}}"},
+    }],
+}
+
+
+def build_chunk(content):
+    return ChatCompletionChunk.model_validate({
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "qwen-turbo-latest",
+        "choices": [{"index": 0, "delta": {"content": content}}],
+    })
+
+
+class FakeCompletions:
+
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **request):
+        self.calls += 1
+        if not request.get("stream"):
+            return ChatCompletion.model_validate(COMPLETION)
+
+        async def stream():
+            for content in ["你", "好"]:
+                await asyncio.sleep(0.01)
+                yield build_chunk(content)
+
+        return stream()
+
+
+def build_client():
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+
+
+REQUEST = {"model": "qwen-turbo-latest", "messages": [{"role": "user", "content": "hi"}]}
+
+
+def test_record_then_replay(tmp_path):
+    client = build_client()
+
+    async def run():
+        recorder = Cassette("record", str(tmp_path))
+        recorded = await recorder.create(client, stream=False, timeout=5, **REQUEST)
+        # timeout 不参与请求哈希
+        replayer = Cassette("replay", str(tmp_path), speed=0)
+        replayed = await replayer.create(None, stream=False, timeout=1, **REQUEST)
+        return recorded, replayed
+
+    recorded, replayed = asyncio.run(run())
+    assert replayed == recorded
+    assert client.chat.completions.calls == 1
+
+
+def test_record_then_replay_stream(tmp_path):
+    client = build_client()
+
+    async def collect(cassette, client):
+        response = await cassette.create(client, stream=True, **REQUEST)
+        return [chunk.choices[0].delta.content async for chunk in response]
+
+    assert asyncio.run(collect(Cassette("record", str(tmp_path)), client)) == ["你", "好"]
+    assert asyncio.run(collect(Cassette("replay", str(tmp_path), speed=10), None)) == ["你", "好"]
+
+
+def test_replay_miss(tmp_path):
+    with pytest.raises(CassetteMissError):
+        asyncio.run(Cassette("replay", str(tmp_path)).create(None, stream=False, **REQUEST))
@@ -0,0 +1,38 @@
+import math
+
+from app.comment_store import convert_xlsx_to_parquet, extract_comments_from_store
+from app.preprocess import preprocess
+from app.process_xlsx import extract_comments_by_video_id
+
+FILE_PATH = "demo_data/output.xlsx"
+
+
+def normalize(comment):
+    return {
+        k: None if isinstance(v, float) and math.isnan(v) else v
+        for k, v in comment.items()
+    }
+
+
+def test_store_matches_excel(tmp_path):
+    store_dir = str(tmp_path / "comment_store")
+    expected = extract_comments_by_video_id(FILE_PATH)
+    assert convert_xlsx_to_parquet(FILE_PATH, store_dir) == sum(
+        len(v["comment_list"]) for v in expected.values())
+
+    data = extract_comments_from_store(store_dir)
+    assert sorted(data) == sorted(expected)
+    for video_id, video in expected.items():
+        assert data[video_id]["industry"] == video["industry"]
+        assert data[video_id]["keyword"] == video["keyword"]
+        assert [normalize(c) for c in preprocess(data[video_id]["comment_list"])] == \
+            [normalize(c) for c in preprocess(video["comment_list"])]
+
+
+def test_store_filters(tmp_path):
+    store_dir = str(tmp_path / "comment_store")
+    convert_xlsx_to_parquet(FILE_PATH, store_dir)
+    video_id = next(iter(extract_comments_by_video_id(FILE_PATH)))
+
+    assert list(extract_comments_from_store(store_dir, video_ids=[video_id])) == [video_id]
+    assert extract_comments_from_store(store_dir, industries=["不存在的行业"]) == {}
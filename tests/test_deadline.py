@@ -0,0 +1,73 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from agent.data_format import Message
+from agent.llm import LLM, LLMSettings
+from agent.deadline import (DeadlineExceeded, current_deadline, deadline_scope,
+                            remaining_time, stop_before_deadline)
+
+
+def test_no_deadline():
+    assert remaining_time() is None
+    assert not stop_before_deadline(SimpleNamespace(upcoming_sleep=60))
+
+
+def test_nested_scope_keeps_earlier_deadline():
+    with deadline_scope(1.0) as outer:
+        with deadline_scope(10.0) as inner:
+            assert inner is outer
+        with deadline_scope(0.5) as inner:
+            assert inner is not outer
+            assert remaining_time() <= 0.5
+        assert current_deadline.get() is outer
+    assert current_deadline.get() is None
+
+
+def test_expired_deadline():
+    with deadline_scope(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            remaining_time()
+
+
+def test_stop_before_deadline():
+    with deadline_scope(5.0):
+        assert not stop_before_deadline(SimpleNamespace(upcoming_sleep=1))
+        assert stop_before_deadline(SimpleNamespace(upcoming_sleep=30))
+
+
+class HangingCompletions:
+
+    def __init__(self):
+        self.calls = 0
+        self.started = asyncio.Event()
+
+    async def create(self, **request):
+        self.calls += 1
+        if self.calls > 1:
+            # 被重试时直接返回，取消被吞掉的情况下测试会失败而不是挂起
+            message = SimpleNamespace(content="done")
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        self.started.set()
+        await asyncio.sleep(3600)
+
+
+def test_cancel_ask_is_not_retried():
+    llm = LLM(LLMSettings(model="qwen-turbo-latest", base_url="http://localhost",
+                          api_key="test", api_type="openai", api_version=""))
+    completions = HangingCompletions()
+    llm.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    async def run():
+        task = asyncio.create_task(
+            llm.ask([Message.user_message("hi")], stream=False))
+        await completions.started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(task, timeout=5)
+
+    asyncio.run(run())
+    assert completions.calls == 1
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from agent.json_repair import repair_partial_json
+
+
+def test_valid_json():
+    assert repair_partial_json('{"a": [1, 2]}') == {"a": [1, 2]}
+
+
+def test_code_fence():
+    assert repair_partial_json('```json\n{"a": 1}\n```') == {"a": 1}
+
+
+def test_truncated_list_keeps_complete_fields():
+    text = ('{"high_intent_comment_list": ['
+            '{"comment_content": "多少钱", "reason": "询价", "uid": "12345678"}, '
+            '{"comment_content": "怎么预约", "reason": "预')
+    result = repair_partial_json(text)
+    assert result == {
+        "high_intent_comment_list": [{
+            "comment_content": "多少钱",
+            "reason": "询价",
+            "uid": "12345678"
+        }, {
+            "comment_content": "怎么预约"
+        }]
+    }
+
+
+def test_truncated_right_after_open():
+    assert repair_partial_json('{"high_intent_comment_list": [') == {
+        "high_intent_comment_list": []
+    }
+
+
+def test_trailing_garbage():
+    assert repair_partial_json('{"a": 1} 以上是结果') == {"a": 1}
+
+
+def test_brackets_inside_string():
+    text = '{"a": ["x]}", "y'
+    assert repair_partial_json(text) == {"a": ["x]}"]}
+
+
+def test_unrepairable():
+    with pytest.raises(json.JSONDecodeError):
+        repair_partial_json("无法解析")
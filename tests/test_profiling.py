@@ -0,0 +1,36 @@
+import os
+import time
+
+from app.profiling import RequestProfile, current_profile, stage
+
+
+def busy_wait(seconds):
+    end_time = time.perf_counter() + seconds
+    while time.perf_counter() < end_time:
+        pass
+
+
+def test_stage_without_profile_is_noop():
+    with stage("preprocess"):
+        pass
+    assert current_profile.get() is None
+
+
+def test_profile_records_stages_and_samples(tmp_path):
+    profile = RequestProfile(str(tmp_path), interval_ms=1)
+    token = current_profile.set(profile)
+    profile.start()
+    try:
+        with stage("preprocess"):
+            busy_wait(0.05)
+    finally:
+        profile.stop()
+        current_profile.reset(token)
+
+    path = profile.save()
+    assert profile.stage_timings["preprocess"] >= 0.05
+    assert os.path.exists(path)
+    assert os.path.exists(os.path.join(str(tmp_path), f"{profile.profile_id}.json"))
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert any(line.startswith("preprocess;") and "busy_wait" in line for line in lines)
@@ -0,0 +1,57 @@
+from app.ranking import ScoreCache, make_video_key, normalize_scores, top_k_by_score
+
+
+def build_comment_dict():
+    return {
+        "10000001": {"uid": "10000001", "like_count": 5, "response_count": 1},
+        "10000002": {"uid": "10000002", "like_count": 50, "response_count": 0},
+        "10000003": {"uid": "10000003", "like_count": 50, "response_count": 3},
+        "10000004": {"uid": "10000004", "like_count": None, "response_count": None},
+    }
+
+
+def test_top_k_tie_break_by_engagement():
+    scores = {"10000001": 3, "10000002": 2, "10000003": 2, "10000004": 2}
+    result = top_k_by_score(scores, build_comment_dict(), 3)
+    assert [c["uid"] for c in result] == ["10000001", "10000003", "10000002"]
+
+
+def test_top_k_skips_low_tiers_and_unknown():
+    # 1 档只是潜在意向，不用于凑满条数
+    scores = {"10000001": 0, "10000002": 1, "10000003": 2, "99999999": 3}
+    result = top_k_by_score(scores, build_comment_dict(), 5)
+    assert [c["uid"] for c in result] == ["10000003"]
+
+
+def test_normalize_scores():
+    assert normalize_scores({"a": 5, "b": -1, "c": "2", "d": True, "e": 2.0}) == {
+        "a": 3, "b": 0, "e": 2
+    }
+
+
+def test_video_key_ignores_comment_order():
+    comments = [{"uid": "1"}, {"uid": "2"}]
+    assert make_video_key("v", comments) == make_video_key("v", comments[::-1])
+    assert make_video_key("v", comments) != make_video_key("w", comments)
+
+
+def test_score_cache_evicts_least_recently_used():
+    cache = ScoreCache(max_videos=2)
+    cache.set("a", {"1": 1})
+    cache.set("b", {"2": 2})
+    cache.get("a")
+    cache.set("c", {"3": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"1": 1}
+    assert len(cache) == 2
+
+
+def test_top_k_tie_break_with_string_counts():
+    comment_dict = {
+        "10000001": {"uid": "10000001", "like_count": "5", "response_count": "x"},
+        "10000002": {"uid": "10000002", "like_count": 50, "response_count": "1"},
+        "10000003": {"uid": "10000003", "like_count": "12", "response_count": 0},
+    }
+    scores = {"10000001": 2, "10000002": 2, "10000003": 2}
+    result = top_k_by_score(scores, comment_dict, 3)
+    assert [c["uid"] for c in result] == ["10000002", "10000003", "10000001"]
@@ -0,0 +1,63 @@
+import asyncio
+
+from agent.shared_state import SharedCache, SharedStore
+
+
+def test_cache_roundtrip_and_expiry(tmp_path):
+    store = SharedStore(str(tmp_path / "shared.db"))
+    store.set("scores", "video", {"10000001": 3}, ttl=60)
+    store.set("scores", "expired", {"10000001": 3}, ttl=-1)
+    assert store.get("scores", "video") == {"10000001": 3}
+    assert store.get("scores", "expired") is None
+    # 另一个连接（相当于另一个 worker）可以读到同一份数据
+    assert SharedStore(str(tmp_path / "shared.db")).get("scores", "video") == {"10000001": 3}
+
+
+def test_token_bucket_is_shared(tmp_path):
+    path = str(tmp_path / "shared.db")
+    first, second = SharedStore(path), SharedStore(path)
+    assert first.try_take_tokens("llm", rate=0.001, capacity=2) == 0
+    assert second.try_take_tokens("llm", rate=0.001, capacity=2) == 0
+    assert first.try_take_tokens("llm", rate=0.001, capacity=2) > 0
+
+
+def test_lease_is_exclusive(tmp_path):
+    store = SharedStore(str(tmp_path / "shared.db"))
+    assert store.try_acquire_lease("scores:video", "a", ttl=60)
+    assert not store.try_acquire_lease("scores:video", "b", ttl=60)
+    store.release_lease("scores:video", "a")
+    assert store.try_acquire_lease("scores:video", "b", ttl=60)
+
+
+def test_get_or_compute_runs_once(tmp_path):
+    cache = SharedCache(SharedStore(str(tmp_path / "shared.db")),
+                        ttl=60,
+                        lease_ttl=10,
+                        poll_interval=0.01)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["10000001"], True
+
+    async def run():
+        return await asyncio.gather(
+            *[cache.get_or_compute("pick", "video:5", compute) for _ in range(4)])
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(result == (["10000001"], True) for result in results)
+
+
+def test_update_many_and_evict(tmp_path):
+    store = SharedStore(str(tmp_path / "shared.db"))
+    store.update_many("verdict", ["a", "b"], lambda key, value: (value or 0) + 1, ttl=60)
+    values = store.update_many("verdict", ["b", "c", "c"], lambda key, value: (value or 0) + 1, ttl=60)
+    assert values == {"b": 2, "c": 1}
+    assert store.get_many("verdict", ["a", "b", "missing"]) == {"a": 1, "b": 2}
+
+    store.evict("verdict", max_entries=2)
+    # 最久未写入的 a 被淘汰
+    assert store.get_many("verdict", ["a", "b", "c"]) == {"b": 2, "c": 1}
+    assert store.count("verdict") == 2
@@ -0,0 +1,146 @@
+from agent.shared_state import SharedStore
+from app.verdict_index import (VerdictIndex, VerdictSettings, make_video_id,
+                               normalize_comment_text, select_known_high_intent)
+
+TEMPLATE = "关注我，免费领取课程资料"
+QUESTION = "请问这个课程一节课多少钱"
+
+
+def build_comment(uid, text):
+    return {"uid": uid, "comment_content": text}
+
+
+def build_index(**settings):
+    return VerdictIndex(VerdictSettings(enabled=True, **settings),
+                        SharedStore(":memory:"))
+
+
+def test_normalize_comment_text():
+    assert normalize_comment_text("@小明 关注我，免费领取课程资料[微笑]！") == \
+        normalize_comment_text("关注我 免费领取课程资料!!")
+    assert normalize_comment_text("ＡＢＣ abc") == "abcabc"
+
+
+def test_make_video_id_ignores_comments():
+    assert make_video_id("行业: 教育", "7091948198109007117") == "id:7091948198109007117"
+    assert make_video_id("行业: 教育") == make_video_id("行业: 教育", None)
+    assert make_video_id("行业: 教育") != make_video_id("行业: 口腔")
+
+
+def test_template_spam_after_min_videos():
+    index = build_index()
+    for i in range(2):
+        index.observe([build_comment(f"1000000{i}", TEMPLATE)], f"video-{i}")
+    remaining, known = index.short_circuit([build_comment("10000009", TEMPLATE)], "video-9")
+    assert len(remaining) == 1 and known == []
+
+    index.observe([build_comment("10000002", TEMPLATE)], "video-2")
+    remaining, known = index.short_circuit([
+        build_comment("10000009", f"@某人 {TEMPLATE}"),
+        # 已判定为刷屏的账号换了文本也会被剔除
+        build_comment("10000002", "这个课程怎么报名呢"),
+        build_comment("10000010", "这个课程怎么报名呢"),
+    ], "video-9")
+    assert [c["uid"] for c in remaining] == ["10000010"] and known == []
+
+
+def test_same_video_with_growing_comments_is_not_spam():
+    index = build_index()
+    comment_list = [build_comment("10000001", "请问这个课程在哪里可以报名呢")]
+    video_id = make_video_id("行业: 教育 关键字: 在线学习")
+    for i in range(3):
+        comment_list = comment_list + [build_comment(f"2000000{i}", f"第{i}条评论")]
+        index.observe(comment_list, video_id)
+    remaining, _ = index.short_circuit(comment_list, video_id)
+    assert len(remaining) == len(comment_list)
+
+
+def test_confidence_accumulates_across_videos_only():
+    index = build_index()
+    comment = build_comment("10000001", QUESTION)
+    index.record_high_intent([comment], "video-0")
+    # 同一视频重复挑选不累积置信度
+    index.record_high_intent([comment], "video-0")
+    assert index.short_circuit([comment], "video-9") == ([comment], [])
+
+    index.record_high_intent([comment], "video-1")
+    assert index.short_circuit([comment], "video-9") == ([], [comment])
+
+
+def test_short_text_is_not_known_high_intent():
+    index = build_index()
+    comment = build_comment("10000001", "多少钱")
+    for i in range(3):
+        index.record_high_intent([comment], f"video-{i}")
+    assert index.short_circuit([build_comment("10000009", "多少钱!")], "video-9")[1] == []
+
+
+def test_select_known_high_intent_dedupes_by_text():
+    known = [build_comment(f"1000000{i}", QUESTION + "!" * i) for i in range(3)]
+    known.append(build_comment("10000009", "另一条高意向的评论内容"))
+    selected, rest = select_known_high_intent(known, 2)
+    assert [c["uid"] for c in selected] == ["10000000", "10000009"]
+    assert [c["uid"] for c in rest] == ["10000001", "10000002"]
+
+
+def test_record_scores_only_returned_tiers():
+    index = build_index(min_confidence=0.5)
+    comments = [build_comment("10000001", "好"),
+                build_comment("10000002", QUESTION),
+                build_comment("10000003", "还行吧"),
+                build_comment("10000004", "一般般")]
+    # 10000004 没有分档，不记录为低意向
+    index.record_scores(comments, {"10000001": 0, "10000002": 3, "10000003": 1}, "video-0")
+    remaining, known = index.short_circuit(comments, "video-0")
+    assert [c["uid"] for c in remaining] == ["10000003", "10000004"]
+    assert [c["uid"] for c in known] == ["10000002"]
+
+    # 低意向判定只在同一视频内生效
+    remaining, _ = index.short_circuit([build_comment("10000009", "好")], "video-1")
+    assert len(remaining) == 1
+
+
+def test_record_scores_counts_duplicate_text_once():
+    index = build_index()
+    comments = [build_comment(f"1000000{i}", QUESTION) for i in range(4)]
+    for _ in range(2):
+        index.record_scores(comments, {c["uid"]: 3 for c in comments}, "video-0")
+    remaining, _ = index.short_circuit([build_comment("10000009", QUESTION)], "video-9")
+    assert len(remaining) == 1
+
+
+def test_high_intent_overrides_spam():
+    index = build_index(min_confidence=0.5)
+    for i in range(3):
+        index.observe([build_comment(f"1000000{i}", TEMPLATE)], f"video-{i}")
+    index.record_scores([build_comment("10000001", TEMPLATE)], {"10000001": 0}, "video-1")
+    index.record_high_intent([build_comment("10000001", TEMPLATE)], "video-1")
+    _, known = index.short_circuit([build_comment("10000009", TEMPLATE)], "video-9")
+    assert len(known) == 1
+
+
+def test_verdicts_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "shared.db")
+    first = VerdictIndex(VerdictSettings(enabled=True), SharedStore(path))
+    second = VerdictIndex(VerdictSettings(enabled=True), SharedStore(path))
+    for i, index in enumerate([first, second, first]):
+        index.observe([build_comment(f"1000000{i}", TEMPLATE)], f"video-{i}")
+    remaining, _ = second.short_circuit([build_comment("10000009", TEMPLATE)], "video-9")
+    assert remaining == []
+
+
+def test_eviction_by_size_and_age():
+    index = build_index(max_entries=2)
+    comments = [build_comment(f"1000000{i}", f"{QUESTION}{i}") for i in range(3)]
+    index.record_high_intent(comments, "video-0", confidence=0.9)
+    assert len(index) == 6
+    index.evict()
+    assert len(index) == 4
+    # 同一批次写入的条目中只保留 max_entries 条
+    remaining, known = index.short_circuit(comments, "video-0")
+    assert len(remaining) == 1 and len(known) == 2
+
+    index = build_index(max_age=0)
+    index.record_high_intent([build_comment("10000001", QUESTION)], "video-0", confidence=0.9)
+    assert index.short_circuit([build_comment("10000001", QUESTION)], "video-0")[0]
+    assert len(index) == 0